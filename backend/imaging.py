@@ -0,0 +1,153 @@
+"""
+CPU-bound image work for the Oriani backend.
+
+Kept free of the web app and database: these functions run in the image
+worker processes and only need Pillow.
+"""
+from dotenv import load_dotenv
+from PIL import Image, ImageOps, features as pil_features
+from typing import List, Optional, Tuple
+from pathlib import Path
+import base64
+import functools
+import io
+import math
+import os
+
+load_dotenv(Path(__file__).parent / '.env')
+
+DERIVATIVE_WIDTHS = sorted(int(w) for w in os.environ.get('DERIVATIVE_WIDTHS', '320,640,1280').split(','))
+# Most preferred first; formats this Pillow build cannot encode are skipped
+DERIVATIVE_FORMATS = [
+    fmt for fmt in os.environ.get('DERIVATIVE_FORMATS', 'avif,webp').split(',')
+    if pil_features.check(fmt)
+]
+DERIVATIVE_QUALITY = int(os.environ.get('DERIVATIVE_QUALITY', 75))
+# Long edge of the stored photo; phone cameras deliver 4000px and more
+NORMALIZE_MAX_DIMENSION = int(os.environ.get('NORMALIZE_MAX_DIMENSION', 2048))
+NORMALIZE_QUALITY = int(os.environ.get('NORMALIZE_QUALITY', 82))
+# Long edge of the inline placeholder; the browser stretches it into a soft blur
+PLACEHOLDER_SIZE = int(os.environ.get('PLACEHOLDER_SIZE', 16))
+PLACEHOLDER_QUALITY = 40
+PLACEHOLDER_FORMAT = "webp" if pil_features.check("webp") else "jpeg"
+
+EXIF_ORIENTATION = 0x0112
+
+# What Pillow raises for files it cannot decode (UnidentifiedImageError and truncated data are OSErrors)
+DECODE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+class UndecodableImage(Exception):
+    """The image itself could not be decoded, as opposed to the worker pool failing around it."""
+
+def decoding(func):
+    """Turn Pillow's decode errors inside a worker entry point into UndecodableImage."""
+    @functools.wraps(func)
+    def wrapper(data):
+        try:
+            return func(data)
+        except DECODE_ERRORS as e:
+            raise UndecodableImage(f"{type(e).__name__}: {e}") from None
+    return wrapper
+
+def has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+@decoding
+def normalize_image(data: bytes) -> Optional[Tuple[bytes, str]]:
+    """Upright copy with the long edge capped and EXIF/GPS/XMP stripped, as (bytes, content type).
+
+    Returns None when the upload should be kept as is: animations, and images that carry no
+    metadata and would not get any smaller.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        if getattr(source, "is_animated", False):
+            return None
+        has_metadata = bool(source.getexif()) or "xmp" in source.info or "XML:com.adobe.xmp" in source.info
+        icc_profile = source.info.get("icc_profile")
+        
+        scale = min(1.0, NORMALIZE_MAX_DIMENSION / max(source.size))
+        # JPEGs decode straight at a reduced size when that still covers the target
+        source.draft("RGB", (math.ceil(source.width * scale), math.ceil(source.height * scale)))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((NORMALIZE_MAX_DIMENSION, NORMALIZE_MAX_DIMENSION), Image.LANCZOS)
+        
+        buffer = io.BytesIO()
+        # Only the colour profile survives; saving without exif= drops everything else
+        if has_alpha(image):
+            image.convert("RGBA").save(buffer, format="PNG", optimize=True, icc_profile=icc_profile)
+            content_type = "image/png"
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=NORMALIZE_QUALITY, optimize=True,
+                                      progressive=True, icc_profile=icc_profile)
+            content_type = "image/jpeg"
+    
+    normalized = buffer.getvalue()
+    if not has_metadata and len(normalized) >= len(data):
+        return None
+    return normalized, content_type
+
+@decoding
+def render_derivatives(source_file) -> List[Tuple[dict, bytes]]:
+    """Encode width-bounded copies of an image (bytes or a binary file) in every configured format."""
+    rendered = []
+    if isinstance(source_file, bytes):
+        source_file = io.BytesIO(source_file)
+    with Image.open(source_file) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        seen_widths = set()
+        for width in DERIVATIVE_WIDTHS:
+            target_width = min(width, image.width)
+            if target_width in seen_widths:
+                continue
+            seen_widths.add(target_width)
+
+            resized = image.copy()
+            resized.thumbnail((target_width, image.height), Image.LANCZOS)
+            for fmt in DERIVATIVE_FORMATS:
+                buffer = io.BytesIO()
+                resized.save(buffer, format=fmt.upper(), quality=DERIVATIVE_QUALITY)
+                variant = {
+                    "width": resized.width,
+                    "height": resized.height,
+                    "format": fmt,
+                    "content_type": f"image/{fmt}",
+                }
+                rendered.append((variant, buffer.getvalue()))
+    return rendered
+
+def difference_hash(image: Image.Image) -> str:
+    """64-bit difference hash as hex; near-identical images differ in only a few bits."""
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+@decoding
+def analyze_image(data: bytes) -> dict:
+    """Upright dimensions, perceptual hash and an inline placeholder (data URI) for an image.
+
+    Images with transparency get no placeholder, since it would show through once loaded.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        width, height = source.size
+        if source.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        transparent = has_alpha(source)
+        # JPEGs decode straight at a fraction of their size; nothing below needs more than 64px
+        source.draft("RGB", (64, 64))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    placeholder = None
+    if not transparent:
+        preview = image.copy()
+        preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        preview.save(buffer, format=PLACEHOLDER_FORMAT.upper(), quality=PLACEHOLDER_QUALITY)
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+        placeholder = f"data:image/{PLACEHOLDER_FORMAT};base64,{encoded}"
+    return {"width": width, "height": height, "phash": difference_hash(image), "placeholder": placeholder}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the Oriani backend.
+
+Usage (from the backend directory):
+    python manage.py migrate-media [--batch-size N]
+    python manage.py backfill-image-info [--batch-size N]
+    python manage.py check-indexes
+    python manage.py build-static
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from server import (
+    db, client, decode_data_uri, store_photo_media, analyze, media_store, mark_content_changed, ensure_indexes,
+    QUERY_SHAPES, AGGREGATE_SHAPES, STATIC_DIR, STATIC_BUILD_DIR, STATIC_MANIFEST,
+)
+from gridfs.errors import NoFile
+
+
+async def migrate_media(batch_size: int):
+    """Move legacy base64 `image_data` payloads (and their derivatives) into the media store."""
+    migrated = 0
+    query = {"media_id": None, "image_data": {"$regex": "^data:"}}
+    while True:
+        photos = await db.photos.find(query, {"_id": 0, "id": 1}).to_list(batch_size)
+        if not photos:
+            break
+        for photo in photos:
+            doc = await db.photos.find_one({"id": photo['id']}, {"_id": 0, "image_data": 1})
+            content_type, data = decode_data_uri(doc['image_data'])
+            media = await store_photo_media(data, content_type)
+            await db.photos.update_one(
+                {"id": photo['id']},
+                {"$set": media, "$unset": {"image_data": ""}}
+            )
+            migrated += 1
+        print(f"Migrated {migrated} photos...")
+    if migrated:
+        # Pages and ETags now point at the media store URLs
+        await mark_content_changed()
+    print(f"Done. {migrated} photos moved to the media store.")
+
+
+async def backfill_image_info(batch_size: int):
+    """Compute dimensions, perceptual hash and placeholder of photos stored before they existed."""
+    analyzed = 0
+    unreadable = []
+    missing = {"$or": [{"phash": {"$exists": False}}, {"placeholder": {"$exists": False}}]}
+    while True:
+        query = {"media_id": {"$ne": None, "$nin": unreadable}, **missing}
+        photos = await db.photos.find(query, {"_id": 0, "id": 1, "media_id": 1}).to_list(batch_size)
+        if not photos:
+            break
+        for photo in photos:
+            if photo['media_id'] in unreadable:
+                continue
+            try:
+                _, chunks = await media_store.open(photo['media_id'])
+                data = b"".join([chunk async for chunk in chunks])
+            except (FileNotFoundError, NoFile):
+                print(f"Skipping photo {photo['id']}: media {photo['media_id']} is missing from the media store")
+                unreadable.append(photo['media_id'])
+                continue
+            # Stored as None when the image cannot be decoded, so the loop never revisits it
+            info = await analyze(photo['media_id'], data)
+            await db.photos.update_many({"media_id": photo['media_id'], **missing}, {"$set": info})
+            analyzed += 1
+        print(f"Analyzed {analyzed} images...")
+    if analyzed:
+        # Pages now render the new dimensions and placeholders
+        await mark_content_changed()
+    print(f"Done. {analyzed} images analyzed{f', {len(unreadable)} missing' if unreadable else ''}.")
+
+
+def find_stages(plan, stage: str) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return True
+        return any(find_stages(value, stage) for value in plan.values())
+    if isinstance(plan, list):
+        return any(find_stages(item, stage) for item in plan)
+    return False
+
+
+async def check_indexes() -> bool:
+    """Explain every query shape the server issues and flag collection scans."""
+    await ensure_indexes()
+    ok = True
+    for collection_name, query, sort in QUERY_SHAPES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.explain()
+        winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+        shape = f"{collection_name}.find({json.dumps(query)}){f'.sort({sort})' if sort else ''}"
+        if find_stages(winning_plan, "COLLSCAN"):
+            ok = False
+            print(f"COLLSCAN  {shape}")
+        else:
+            print(f"ok        {shape}")
+    for collection_name, pipeline in AGGREGATE_SHAPES:
+        plan = await db.command(
+            "explain", {"aggregate": collection_name, "pipeline": pipeline, "cursor": {}},
+            verbosity="queryPlanner"
+        )
+        shape = f"{collection_name}.aggregate({json.dumps([list(stage)[0] for stage in pipeline])})"
+        if find_stages(plan, "COLLSCAN"):
+            ok = False
+            print(f"COLLSCAN  {shape}")
+        else:
+            print(f"ok        {shape}")
+    return ok
+
+
+def compressed_siblings(data: bytes) -> dict:
+    siblings = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        siblings[".br"] = brotli.compress(data, quality=11)
+    # Already-compressed formats (PNG, WOFF2...) barely shrink; only keep siblings that save 10%+
+    return {suffix: packed for suffix, packed in siblings.items() if len(packed) < len(data) * 0.9}
+
+
+def build_static():
+    """Write content-hashed copies of every static file, their gzip/brotli siblings and the manifest."""
+    if brotli is None:
+        print("brotli is not installed; writing gzip siblings only")
+    shutil.rmtree(STATIC_BUILD_DIR, ignore_errors=True)
+    manifest = {}
+    for source in sorted(STATIC_DIR.rglob("*")):
+        if not source.is_file() or STATIC_BUILD_DIR in source.parents:
+            continue
+        data = source.read_bytes()
+        relative = source.relative_to(STATIC_DIR)
+        fingerprint = hashlib.sha256(data).hexdigest()[:12]
+        target = STATIC_BUILD_DIR / relative.with_name(f"{relative.stem}.{fingerprint}{relative.suffix}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        for suffix, packed in compressed_siblings(data).items():
+            target.with_name(target.name + suffix).write_bytes(packed)
+        manifest[relative.as_posix()] = target.relative_to(STATIC_DIR).as_posix()
+        print(f"{relative.as_posix()} -> {manifest[relative.as_posix()]}")
+    STATIC_MANIFEST.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    print(f"Done. {len(manifest)} assets fingerprinted.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oriani backend maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate-media", help="Move base64 image_data into the media store")
+    migrate_parser.add_argument("--batch-size", type=int, default=50)
+
+    info_parser = subparsers.add_parser("backfill-image-info",
+                                        help="Compute dimensions, placeholder and duplicate hash of existing photos")
+    info_parser.add_argument("--batch-size", type=int, default=50)
+
+    subparsers.add_parser("check-indexes", help="Fail if any server query falls back to a collection scan")
+
+    subparsers.add_parser("build-static", help="Fingerprint and precompress backend/static")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "migrate-media":
+            asyncio.run(migrate_media(args.batch_size))
+        elif args.command == "backfill-image-info":
+            asyncio.run(backfill_image_info(args.batch_size))
+        elif args.command == "check-indexes":
+            if not asyncio.run(check_indexes()):
+                sys.exit(1)
+        elif args.command == "build-static":
+            build_static()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,244 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Request, Response
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import Headers, MutableHeaders
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from gridfs.errors import NoFile
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+import jinja2
 from datetime import datetime, timedelta, timezone
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, computed_field
+from typing import AsyncIterator, List, Optional, Tuple
+from imaging import (
+    DERIVATIVE_FORMATS, DERIVATIVE_WIDTHS, UndecodableImage, analyze_image, normalize_image, render_derivatives,
+)
 import os
 import logging
 import uuid
 import base64
+import asyncio
+import contextvars
+import hashlib
+import hmac
+import io
+import json
+import mimetypes
+import multiprocessing
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from email.utils import format_datetime, parsedate_to_datetime
 from pathlib import Path
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ============= METRICS =============
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HTTP_REQUESTS = Counter(
+    "oriani_http_requests_total", "HTTP requests handled", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "oriani_http_request_duration_seconds", "Time to send the full response", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS)
+HTTP_RESPONSE_SIZE = Histogram(
+    "oriani_http_response_size_bytes", "Response body bytes as sent", ["method", "route", "status"],
+    buckets=SIZE_BUCKETS)
+MONGO_COMMAND_LATENCY = Histogram(
+    "oriani_mongo_command_duration_seconds", "MongoDB command round-trip time", ["command", "collection", "outcome"],
+    buckets=LATENCY_BUCKETS)
+TEMPLATE_RENDER_LATENCY = Histogram(
+    "oriani_template_render_duration_seconds", "Jinja2 render time", ["template"], buckets=LATENCY_BUCKETS)
+UPLOAD_SIZE = Histogram(
+    "oriani_upload_size_bytes", "Size of stored photo uploads", buckets=SIZE_BUCKETS)
+UPLOAD_REJECTIONS = Counter(
+    "oriani_upload_rejections_total", "Photo uploads rejected during ingestion", ["status"])
+REQUEST_MONGO_COMMANDS = Histogram(
+    "oriani_request_mongo_commands", "MongoDB commands issued per HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+
+# ============= MONGO COMMAND MONITORING =============
+MONGO_SLOW_COMMAND_MS = float(os.environ.get('MONGO_SLOW_COMMAND_MS', 100))
+# Requests issuing at least this many commands are logged as warnings (likely N+1)
+MONGO_REQUEST_COMMANDS_WARN = int(os.environ.get('MONGO_REQUEST_COMMANDS_WARN', 20))
+# Where each command keeps its filter
+COMMAND_FILTER_FIELDS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+
+class RequestQueries:
+    """MongoDB commands attributed to one HTTP request."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.db_time = 0.0
+        self.shapes = {}
+
+    def record(self, shape: str, seconds: float) -> None:
+        self.count += 1
+        self.db_time += seconds
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        return sorted(((shape, n) for shape, n in self.shapes.items() if n > 1), key=lambda item: -item[1])
+
+# Motor copies the caller's context onto its executor threads, so listener events see this
+current_queries: contextvars.ContextVar[Optional[RequestQueries]] = contextvars.ContextVar('current_queries', default=None)
+
+def query_shape(value):
+    """Replace literal values with '?' so commands differing only in their parameters group together."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [query_shape(value[0])] if value else []
+    return "?"
+
+def command_shape(command_name: str, command) -> str:
+    if command_name == "aggregate":
+        stages = [next(iter(stage)) for stage in command.get("pipeline", []) if stage]
+        match = next((stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), None)
+        return json.dumps({"pipeline": stages, "match": query_shape(match)} if match else {"pipeline": stages})
+    if command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        return json.dumps(query_shape(statements[0].get("q", {})))
+    field = COMMAND_FILTER_FIELDS.get(command_name)
+    return json.dumps(query_shape(command.get(field, {}))) if field else ""
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Times MongoDB commands for metrics, per-request counts and the slow-command log."""
+
+    def __init__(self):
+        # Collection, filter shape and request are only known on the started event
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        collection = collection if isinstance(collection, str) else ""
+        try:
+            shape = command_shape(event.command_name, event.command)
+        except (TypeError, ValueError):
+            shape = "<unavailable>"
+        self.pending[(event.connection_id, event.request_id)] = (collection, shape, current_queries.get())
+
+    def _observe(self, event, outcome: str):
+        collection, shape, queries = self.pending.pop((event.connection_id, event.request_id), ("", "", None))
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_LATENCY.labels(event.command_name, collection, outcome).observe(seconds)
+        description = f"{event.command_name} {collection} {shape}".strip()
+        if queries is not None:
+            queries.record(description, seconds)
+        if seconds * 1000 >= MONGO_SLOW_COMMAND_MS:
+            logger.warning(
+                f"Slow Mongo command ({seconds * 1000:.1f}ms, {outcome}): {description}"
+                f" [{queries.label if queries else 'no request'}]"
+            )
+
+    def succeeded(self, event):
+        self._observe(event, "ok")
+
+    def failed(self, event):
+        self._observe(event, "error")
+
+class QueryTrackingMiddleware:
+    """Counts the MongoDB commands and DB time of each request and logs heavy requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        queries = RequestQueries(f"{scope['method']} {scope['path']}")
+        token = current_queries.set(queries)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_queries.reset(token)
+            REQUEST_MONGO_COMMANDS.labels(route_label(scope)).observe(queries.count)
+            summary = f"{queries.label}: {queries.count} Mongo commands, {queries.db_time * 1000:.1f}ms DB time"
+            if queries.count >= MONGO_REQUEST_COMMANDS_WARN:
+                repeated = ", ".join(f"{n}x {shape}" for shape, n in queries.repeated()[:3])
+                logger.warning(f"{summary}; repeated: {repeated or 'none'}")
+            else:
+                logger.debug(summary)
+
+class InstrumentedTemplate(jinja2.Template):
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            TEMPLATE_RENDER_LATENCY.labels(self.name).observe(time.perf_counter() - started)
+
+def route_label(scope) -> str:
+    """Route template for a handled request, so /media/{photo_id} is one series rather than one per photo."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("endpoint") is not None and scope.get("root_path"):
+        # Mounted app such as /static
+        return f"{scope['root_path']}/{{path}}"
+    return "<unmatched>"
+
+class MetricsMiddleware:
+    """Records count, latency and response size per (method, route template, status)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        started = time.perf_counter()
+        status_code = 500
+        body_bytes = 0
+
+        async def measuring_send(message):
+            nonlocal status_code, body_bytes
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measuring_send)
+        finally:
+            labels = (scope["method"], route_label(scope), str(status_code))
+            HTTP_REQUESTS.labels(*labels).inc()
+            HTTP_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+            HTTP_RESPONSE_SIZE.labels(*labels).observe(body_bytes)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMonitor()])
 db = client[os.environ.get('DB_NAME', 'oriani_database')]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 security = HTTPBearer(auto_error=False)
 JWT_SECRET = os.environ.get('JWT_SECRET_KEY', 'default_secret_key_change_me')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
@@ -36,11 +248,33 @@ ACCESS_TOKEN_EXPIRE = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 1440))
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
-# Mount static files
-app.mount("/static", StaticFiles(directory=ROOT_DIR / "static"), name="static")
-
 # Templates
-templates = Jinja2Templates(directory=ROOT_DIR / "templates")
+# Production default: templates never change under a running worker, so skip the mtime checks
+TEMPLATE_AUTO_RELOAD = os.environ.get('TEMPLATE_AUTO_RELOAD', 'false').lower() in ('1', 'true', 'yes')
+# Render cached public pages with Jinja's async generator so <head> reaches the browser first
+TEMPLATE_STREAMING = os.environ.get('TEMPLATE_STREAMING', 'false').lower() in ('1', 'true', 'yes')
+TEMPLATE_CACHE_DIR = Path(os.environ.get('TEMPLATE_CACHE_DIR', ROOT_DIR / '.template_cache'))
+STREAM_FLUSH_BYTES = 16 * 1024
+
+def template_environment(enable_async: bool = False) -> jinja2.Environment:
+    # Sync and async environments compile to different code, so they need separate bytecode caches
+    cache_dir = TEMPLATE_CACHE_DIR / ("async" if enable_async else "sync")
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(ROOT_DIR / "templates"),
+        autoescape=True,
+        auto_reload=TEMPLATE_AUTO_RELOAD,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(str(cache_dir)),
+        enable_async=enable_async,
+    )
+
+templates = Jinja2Templates(env=template_environment())
+templates.env.template_class = InstrumentedTemplate
+streaming_env = None
+if TEMPLATE_STREAMING:
+    streaming_env = template_environment(enable_async=True)
+    # Share one globals dict so helpers registered on `templates` reach streamed pages too
+    streaming_env.globals = templates.env.globals
 
 # ============= MODELS =============
 class User(BaseModel):
@@ -75,15 +309,71 @@ class AlbumCreate(BaseModel):
     description: str
     category: str
 
-class Photo(BaseModel):
+PHOTO_PROCESSING = "processing"
+PHOTO_READY = "ready"
+
+class PhotoVariant(BaseModel):
+    width: int
+    height: int
+    format: str
+    content_type: str
+    media_id: str
+    size: int
+
+class PhotoSummary(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     album_id: str
     title: str
     description: Optional[str] = ""
-    image_data: str  # base64 encoded image
+    media_id: Optional[str] = None  # SHA-256 key in the media store
+    source_media_id: Optional[str] = None  # key of the bytes as uploaded, before normalization
+    original_media_id: Optional[str] = None  # uploaded bytes, kept only with NORMALIZE_KEEP_ORIGINAL
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    variants: List[PhotoVariant] = []
+    # "processing" until the image workers have built the derivatives; legacy documents have no status
+    status: str = PHOTO_READY
+    phash: Optional[str] = None  # 64-bit difference hash (hex) for the near-duplicate report
+    # Upright pixel size and a tiny data URI preview, so pages reserve the layout and paint a blur first
+    width: Optional[int] = None
+    height: Optional[int] = None
+    placeholder: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+    @computed_field
+    @property
+    def image_url(self) -> str:
+        return media_url(self)
+
+class Photo(PhotoSummary):
+    image_data: Optional[str] = None  # base64 data URI; only stored by legacy documents
+
+# Listings and pages never need the image payload
+PHOTO_SUMMARY_PROJECTION = {"_id": 0, "image_data": 0}
+# Public pages only show photos whose derivatives are built
+READY_PHOTOS = {"status": {"$ne": PHOTO_PROCESSING}}
+# Deleted albums stay in the collection until their background cascade runs; hide them everywhere
+LIVE_ALBUMS = {"deleted_at": None}
+
+class BatchUploadResult(BaseModel):
+    filename: str
+    ok: bool
+    photo: Optional[Photo] = None
+    error: Optional[str] = None
+
+class ManifestPhoto(BaseModel):
+    id: str
+    title: str
+    description: str = ""
+    album: str
+    category: str
+    src: str  # lightbox-sized image URL
+
+class GalleryManifest(BaseModel):
+    photos: List[ManifestPhoto]
+    next_cursor: Optional[str] = None
+
 class PhotoCreate(BaseModel):
     album_id: str
     title: str
@@ -99,6 +389,1277 @@ CATEGORIES = [
     "Alvenaria e Drywall"
 ]
 
+# ============= MEDIA STORAGE =============
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'gridfs')
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', ROOT_DIR / 'media'))
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+class MediaStore(ABC):
+    """Content-addressed blob storage: every blob is keyed by the SHA-256 of its bytes."""
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    async def put(self, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    async def put_stream(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        """Store a blob as it arrives, hashing incrementally. Returns (key, size).
+
+        If `chunks` raises, the partial blob is discarded and the error propagates.
+        """
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def open(self, key: str) -> Tuple[int, AsyncIterator[bytes]]:
+        """Return the blob size and an async iterator over its chunks."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def iter_blobs(self) -> AsyncIterator[Tuple[str, float]]:
+        """Yield (key, last write as a Unix timestamp) for every stored blob."""
+
+    @abstractmethod
+    async def purge_pending(self, older_than: float) -> int:
+        """Remove partial uploads left behind by crashed workers; returns how many."""
+
+class GridFSMediaStore(MediaStore):
+    def __init__(self, database, bucket_name: str = "media"):
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name=bucket_name)
+        self.files = database[f"{bucket_name}.files"]
+
+    async def put(self, data: bytes) -> str:
+        key = self.key_for(data)
+        if not await self.touch(key):
+            await self.bucket.upload_from_stream(key, data, chunk_size_bytes=MEDIA_CHUNK_SIZE)
+        return key
+
+    async def touch(self, key: str) -> bool:
+        # Reusing a blob makes it young again, so garbage collection's grace period covers the new reference
+        result = await self.files.update_one({"filename": key}, {"$set": {"uploadDate": datetime.now(timezone.utc)}})
+        return result.matched_count > 0
+
+    async def put_stream(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        grid_in = self.bucket.open_upload_stream(f"pending-{uuid.uuid4().hex}", chunk_size_bytes=MEDIA_CHUNK_SIZE)
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        
+        key = digest.hexdigest()
+        if await self.touch(key):
+            await self.bucket.delete(grid_in._id)
+        else:
+            await self.bucket.rename(grid_in._id, key)
+        return key, size
+
+    async def exists(self, key: str) -> bool:
+        return await self.files.find_one({"filename": key}, {"_id": 1}) is not None
+
+    async def open(self, key: str) -> Tuple[int, AsyncIterator[bytes]]:
+        grid_out = await self.bucket.open_download_stream_by_name(key)
+
+        async def chunks():
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+
+        return grid_out.length, chunks()
+
+    async def delete(self, key: str) -> None:
+        async for grid_file in self.files.find({"filename": key}, {"_id": 1}):
+            await self.bucket.delete(grid_file["_id"])
+
+    async def iter_blobs(self) -> AsyncIterator[Tuple[str, float]]:
+        query = {"filename": {"$not": {"$regex": "^pending-"}}}
+        async for grid_file in self.files.find(query, {"filename": 1, "uploadDate": 1}):
+            yield grid_file["filename"], grid_file["uploadDate"].replace(tzinfo=timezone.utc).timestamp()
+
+    async def purge_pending(self, older_than: float) -> int:
+        query = {"filename": {"$regex": "^pending-"}, "uploadDate": {"$lt": datetime.fromtimestamp(older_than, timezone.utc)}}
+        purged = 0
+        async for grid_file in self.files.find(query, {"_id": 1}):
+            await self.bucket.delete(grid_file["_id"])
+            purged += 1
+        return purged
+
+class FileSystemMediaStore(MediaStore):
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        if path.exists():
+            # Reusing a blob makes it young again, so garbage collection's grace period covers the new reference
+            os.utime(path)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def put(self, data: bytes) -> str:
+        key = self.key_for(data)
+        await asyncio.to_thread(self._write, key, data)
+        return key
+
+    def _open_pending(self):
+        pending_dir = self.root / ".pending"
+        pending_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = pending_dir / uuid.uuid4().hex
+        return tmp_path, open(tmp_path, "wb")
+
+    def _commit_pending(self, tmp_path: Path, key: str) -> None:
+        path = self._path(key)
+        if path.exists():
+            os.utime(path)
+            tmp_path.unlink()
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+
+    async def put_stream(self, chunks: AsyncIterator[bytes]) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path, handle = await asyncio.to_thread(self._open_pending)
+        try:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(handle.write, chunk)
+        except BaseException:
+            handle.close()
+            await asyncio.to_thread(tmp_path.unlink, True)
+            raise
+        handle.close()
+        
+        key = digest.hexdigest()
+        await asyncio.to_thread(self._commit_pending, tmp_path, key)
+        return key, size
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._path(key).exists)
+
+    async def open(self, key: str) -> Tuple[int, AsyncIterator[bytes]]:
+        path = self._path(key)
+        handle = await asyncio.to_thread(open, path, "rb")
+        size = os.fstat(handle.fileno()).st_size
+
+        async def chunks():
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(handle.read, MEDIA_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                handle.close()
+
+        return size, chunks()
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._path(key).unlink, True)
+
+    def _list_blobs(self) -> List[Tuple[str, float]]:
+        if not self.root.exists():
+            return []
+        return [
+            (path.name, path.stat().st_mtime)
+            for shard in self.root.iterdir() if shard.is_dir() and shard.name != ".pending"
+            for path in shard.iterdir() if path.suffix != ".tmp"
+        ]
+
+    async def iter_blobs(self) -> AsyncIterator[Tuple[str, float]]:
+        for blob in await asyncio.to_thread(self._list_blobs):
+            yield blob
+
+    def _purge_pending(self, older_than: float) -> int:
+        stale = [
+            path for path in list((self.root / ".pending").glob("*")) + list(self.root.glob("*/*.tmp"))
+            if path.stat().st_mtime < older_than
+        ]
+        for path in stale:
+            path.unlink(missing_ok=True)
+        return len(stale)
+
+    async def purge_pending(self, older_than: float) -> int:
+        return await asyncio.to_thread(self._purge_pending, older_than)
+
+def create_media_store() -> MediaStore:
+    if MEDIA_BACKEND == 'filesystem':
+        return FileSystemMediaStore(MEDIA_ROOT)
+    if MEDIA_BACKEND == 'gridfs':
+        return GridFSMediaStore(db)
+    raise RuntimeError(f"Unknown MEDIA_BACKEND: {MEDIA_BACKEND}")
+
+media_store = create_media_store()
+
+def media_url(photo) -> str:
+    # The ?v= content hash makes media URLs safe to cache as immutable
+    if isinstance(photo, dict):
+        photo_id, media_id = photo['id'], photo.get('media_id')
+    else:
+        photo_id, media_id = photo.id, photo.media_id
+    url = f"/media/{photo_id}"
+    return f"{url}?v={media_id[:12]}" if media_id else url
+
+def decode_data_uri(data_uri: str) -> Tuple[str, bytes]:
+    header, _, encoded = data_uri.partition(',')
+    content_type = header[len('data:'):].split(';')[0] or "application/octet-stream"
+    return content_type, base64.b64decode(encoded)
+
+# ============= IMAGE WORKERS =============
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', min(4, os.cpu_count() or 1)))
+# Photos waiting for derivatives; uploads beyond this get a 503
+IMAGE_QUEUE_SIZE = int(os.environ.get('IMAGE_QUEUE_SIZE', 200))
+IMAGE_RETRY_AFTER = int(os.environ.get('IMAGE_RETRY_AFTER', 30))
+# How long a worker holds a photo it is processing before another process may take it over
+IMAGE_LEASE_SECONDS = int(os.environ.get('IMAGE_LEASE_SECONDS', 300))
+# How often photos whose processing failed (and whose lease expired) are queued again
+IMAGE_RESUME_INTERVAL = int(os.environ.get('IMAGE_RESUME_INTERVAL', 300))
+# Rotate, strip metadata and downscale uploads before storing them (see imaging.normalize_image)
+NORMALIZE_UPLOADS = os.environ.get('NORMALIZE_UPLOADS', 'true').lower() == 'true'
+NORMALIZE_KEEP_ORIGINAL = os.environ.get('NORMALIZE_KEEP_ORIGINAL', 'false').lower() == 'true'
+
+class ImageWorkerPool:
+    """Builds photo derivatives in worker processes so decoding and encoding never block the event loop.
+
+    Uploads reserve queue slots before storing anything and are turned away with a 503 once
+    IMAGE_QUEUE_SIZE photos are waiting. Queued photos stay `processing` until a worker
+    stores their derivatives and marks them `ready`. A worker claims a photo with a lease
+    before working on it, so a photo queued by several processes is only processed once.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = asyncio.Queue()
+        self.queued_ids = set()
+        self.reserved = 0
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+        self._executor = None
+        self._tasks = []
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned rather than forked, so workers never inherit the event loop, threads or open sockets.
+            # They import imaging and re-import the parent's entry module (e.g. manage.py, which imports
+            # this module); nothing at import time connects to MongoDB or starts work.
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def run(self, func, data: bytes):
+        executor = self._pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, data)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next photo
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def free_slots(self) -> int:
+        return self.queue_size - self.queue.qsize() - self.reserved
+
+    @contextmanager
+    def reserve(self, count: int):
+        if count > self.free_slots():
+            UPLOAD_REJECTIONS.labels("503").inc()
+            raise HTTPException(
+                status_code=503, detail="Image processing queue is full, try again shortly",
+                headers={"Retry-After": str(IMAGE_RETRY_AFTER)}
+            )
+        self.reserved += count
+        try:
+            yield
+        finally:
+            self.reserved -= count
+
+    def submit(self, photo_id: str) -> None:
+        if photo_id not in self.queued_ids:
+            self.queued_ids.add(photo_id)
+            self.queue.put_nowait(photo_id)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.queue_size,
+            "queued": self.queue.qsize(),
+            "in_progress": self.in_progress,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _work(self) -> None:
+        while True:
+            photo_id = await self.queue.get()
+            self.queued_ids.discard(photo_id)
+            self.in_progress += 1
+            try:
+                await self.process(photo_id)
+            except Exception as e:
+                # The photo stays `processing`; resume_image_processing retries it once the lease expires
+                self.failed += 1
+                logger.warning(f"Could not process photo {photo_id}: {e!r}")
+            finally:
+                self.in_progress -= 1
+                self.queue.task_done()
+
+    async def process(self, photo_id: str) -> None:
+        now = datetime.now(timezone.utc)
+        photo = await db.photos.find_one_and_update(
+            {"id": photo_id, **unclaimed_photos(now)},
+            {"$set": {"processing_until": now + timedelta(seconds=IMAGE_LEASE_SECONDS)}},
+            {"_id": 0, "album_id": 1, "media_id": 1, "source_media_id": 1, "content_type": 1}
+        )
+        if photo is None:
+            return  # Deleted meanwhile, or processed or being processed by another worker
+        
+        # Re-uploads of the same bytes (e.g. into a second album) share the first copy's processed media
+        twin = await db.photos.find_one(
+            {"source_media_id": photo['source_media_id'], **PROCESSED_TWIN},
+            {"_id": 0, **{field: 1 for field in PROCESSED_MEDIA_FIELDS}}
+        )
+        if twin is not None:
+            media = {field: twin.get(field) for field in PROCESSED_MEDIA_FIELDS}
+        else:
+            _, chunks = await media_store.open(photo['media_id'])
+            data = b"".join([chunk async for chunk in chunks])
+            media = await process_media(photo['media_id'], data, photo['content_type'])
+        
+        result = await db.photos.update_one(
+            {"id": photo_id, "status": PHOTO_PROCESSING},
+            {"$set": {**media, "status": PHOTO_READY}, "$unset": {"processing_until": ""}}
+        )
+        self.processed += 1
+        if result.modified_count:
+            await mark_content_changed(await album_category(photo['album_id']))
+
+# Only copies that got derivatives are shared; images that could not be decoded are kept as uploaded
+PROCESSED_TWIN = {**READY_PHOTOS, "placeholder": {"$exists": True}, "variants.0": {"$exists": True}}
+
+def unclaimed_photos(now: datetime) -> dict:
+    """Photos waiting for derivatives that no worker holds a live lease on."""
+    return {"status": PHOTO_PROCESSING, "$or": [
+        {"processing_until": {"$exists": False}},
+        {"processing_until": {"$lt": now}},
+    ]}
+
+image_workers = ImageWorkerPool(IMAGE_WORKERS, IMAGE_QUEUE_SIZE)
+
+async def load_image_data(photo: dict) -> Optional[str]:
+    """Rebuild the legacy data URI payload for clients that still ask for it."""
+    if not photo.get('media_id'):
+        return None
+    _, chunks = await media_store.open(photo['media_id'])
+    contents = b"".join([chunk async for chunk in chunks])
+    image_base64 = base64.b64encode(contents).decode('utf-8')
+    return f"data:{photo.get('content_type') or 'image/jpeg'};base64,{image_base64}"
+
+IMAGE_INFO_FIELDS = ("width", "height", "phash", "placeholder")
+
+# Only errors from decoding the image itself mean "keep it as uploaded". Pool and storage failures
+# propagate, leaving the photo `processing` for a retry instead of marking it ready unprocessed.
+async def analyze(media_id: str, data: bytes) -> dict:
+    """Dimensions, perceptual hash and placeholder of an image; all None when it cannot be decoded."""
+    try:
+        return await image_workers.run(analyze_image, data)
+    except UndecodableImage as e:
+        logger.warning(f"Could not analyze media {media_id}: {e}")
+        return dict.fromkeys(IMAGE_INFO_FIELDS)
+
+async def build_variants(media_id: str, data: bytes) -> List[dict]:
+    try:
+        rendered = await image_workers.run(render_derivatives, data)
+    except UndecodableImage as e:
+        logger.warning(f"Could not build derivatives for media {media_id}: {e}")
+        return []
+    
+    variants = []
+    for variant, data in rendered:
+        variant['media_id'] = await media_store.put(data)
+        variant['size'] = len(data)
+        variants.append(variant)
+    return variants
+
+# What the image workers fill in; copied as a whole between photos uploaded from the same bytes
+PROCESSED_MEDIA_FIELDS = ("media_id", "original_media_id", "content_type", "size", "variants", *IMAGE_INFO_FIELDS)
+
+async def normalize(media_id: str, data: bytes) -> Optional[Tuple[bytes, str]]:
+    if not NORMALIZE_UPLOADS:
+        return None
+    try:
+        return await image_workers.run(normalize_image, data)
+    except UndecodableImage as e:
+        logger.warning(f"Could not normalize media {media_id}: {e}")
+        return None
+
+async def process_media(source_id: str, data: bytes, content_type: str) -> dict:
+    """Normalize stored upload bytes, then build derivatives and the image info from the result."""
+    media = {"media_id": source_id, "original_media_id": None, "content_type": content_type, "size": len(data)}
+    normalized = await normalize(source_id, data)
+    if normalized is not None:
+        data, content_type = normalized
+        media.update(media_id=await media_store.put(data), content_type=content_type, size=len(data))
+        if NORMALIZE_KEEP_ORIGINAL:
+            media['original_media_id'] = source_id
+    media['variants'] = await build_variants(media['media_id'], data)
+    media.update(await analyze(media['media_id'], data))
+    return media
+
+async def store_photo_media(contents: bytes, content_type: str) -> dict:
+    source_id = await media_store.put(contents)
+    return {"source_media_id": source_id, **await process_media(source_id, contents, content_type)}
+
+# ============= UPLOAD INGESTION =============
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 5 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 50))
+# Files processed at once per batch request
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 4))
+# Room for multipart boundaries and the other form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+# Request body limits enforced before the form is parsed
+UPLOAD_BODY_LIMITS = {
+    "/api/photos/upload": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/api/photos/upload/batch": MAX_BATCH_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD),
+    "/admin/photo/upload": MAX_BATCH_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD),
+}
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Identify an image from its magic bytes, ignoring whatever the client claims."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    return None
+
+async def read_upload(file: UploadFile, first_chunk: bytes) -> AsyncIterator[bytes]:
+    total = len(first_chunk)
+    yield first_chunk
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File exceeds {MAX_UPLOAD_BYTES} bytes")
+        yield chunk
+
+async def ingest_upload(file: UploadFile) -> dict:
+    """Stream an uploaded image into the media store; derivatives are left to the image workers."""
+    try:
+        media = await ingest_upload_media(file)
+    except HTTPException as e:
+        UPLOAD_REJECTIONS.labels(str(e.status_code)).inc()
+        raise
+    UPLOAD_SIZE.observe(media["size"])
+    return media
+
+async def ingest_upload_media(file: UploadFile) -> dict:
+    first_chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    content_type = sniff_image_type(first_chunk)
+    if content_type is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type")
+    if len(first_chunk) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds {MAX_UPLOAD_BYTES} bytes")
+    
+    media_id, size = await media_store.put_stream(read_upload(file, first_chunk))
+    return {"media_id": media_id, "source_media_id": media_id, "content_type": content_type, "size": size}
+
+async def prepare_photo(album: dict, title: str, description: str, file: UploadFile) -> Photo:
+    media = await ingest_upload(file)
+    return Photo(
+        album_id=album['id'],
+        title=title,
+        description=description or "",
+        status=PHOTO_PROCESSING,
+        **media
+    )
+
+def photo_document(photo_obj: Photo) -> dict:
+    doc = photo_obj.model_dump(exclude={'image_url'})
+    doc['created_at'] = doc['created_at'].isoformat()
+    return doc
+
+async def create_photo(album: dict, title: str, description: str, file: UploadFile) -> Photo:
+    """Shared ingestion path for every single-file upload route."""
+    with image_workers.reserve(1):
+        photo_obj = await prepare_photo(album, title, description, file)
+        await db.photos.insert_one(photo_document(photo_obj))
+        image_workers.submit(photo_obj.id)
+    await mark_content_changed(album.get('category'))
+    return photo_obj
+
+def batch_title(title: str, file: UploadFile, index: int, count: int) -> str:
+    if not title:
+        return Path(file.filename or "").stem or f"Foto {index}"
+    return f"{title} {index}" if count > 1 else title
+
+async def create_photos(album: dict, title: str, description: str, files: List[UploadFile]) -> List[BatchUploadResult]:
+    """Ingest several files into one album concurrently and insert them with a single write."""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    
+    limit = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    
+    async def process(index: int, file: UploadFile) -> BatchUploadResult:
+        async with limit:
+            try:
+                photo_obj = await prepare_photo(album, batch_title(title, file, index, len(files)), description, file)
+            except HTTPException as e:
+                return BatchUploadResult(filename=file.filename or "", ok=False, error=e.detail)
+            except (PyMongoError, OSError) as e:
+                # A storage failure fails this file only; the others are still inserted below.
+                logger.warning(f"Could not store upload {file.filename!r}: {e!r}")
+                return BatchUploadResult(filename=file.filename or "", ok=False, error="Could not store file")
+        return BatchUploadResult(filename=file.filename or "", ok=True, photo=photo_obj)
+    
+    with image_workers.reserve(len(files)):
+        results = await asyncio.gather(*(process(i, f) for i, f in enumerate(files, start=1)))
+        
+        stored = [result.photo for result in results if result.ok]
+        if stored:
+            await db.photos.insert_many([photo_document(photo_obj) for photo_obj in stored], ordered=False)
+            for photo_obj in stored:
+                image_workers.submit(photo_obj.id)
+    if stored:
+        await mark_content_changed(album.get('category'))
+    return results
+
+class UploadLimitMiddleware:
+    """Rejects oversized upload bodies before they are spooled by the form parser."""
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413)
+            return await response(scope, receive, send)
+        
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def variant_url(photo, variant) -> str:
+    return f"/media/{photo['id']}/{variant['width']}.{variant['format']}?v={variant['media_id'][:12]}"
+
+def photo_srcsets(photo) -> List[Tuple[str, str]]:
+    """(content type, srcset) pairs for the photo's derivatives, most preferred format first."""
+    variants = photo.get('variants') or []
+    srcsets = []
+    for fmt in dict.fromkeys(v['format'] for v in variants):
+        candidates = sorted((v for v in variants if v['format'] == fmt), key=lambda v: v['width'])
+        srcset = ", ".join(f"{variant_url(photo, v)} {v['width']}w" for v in candidates)
+        srcsets.append((candidates[0]['content_type'], srcset))
+    return srcsets
+
+def lightbox_url(photo) -> str:
+    """Largest derivative in the most widely supported format, falling back to the original."""
+    variants = photo.get('variants') or []
+    webp = [v for v in variants if v['format'] == 'webp']
+    if not webp:
+        return media_url(photo)
+    return variant_url(photo, max(webp, key=lambda v: v['width']))
+
+templates.env.globals['media_url'] = media_url
+templates.env.globals['photo_srcsets'] = photo_srcsets
+templates.env.globals['lightbox_url'] = lightbox_url
+
+# ============= STATIC ASSETS =============
+STATIC_DIR = ROOT_DIR / "static"
+# `python manage.py build-static` writes fingerprinted copies and their manifest here
+STATIC_BUILD_DIR = STATIC_DIR / "dist"
+STATIC_MANIFEST = STATIC_BUILD_DIR / "manifest.json"
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+def load_static_manifest() -> dict:
+    try:
+        return json.loads(STATIC_MANIFEST.read_text())
+    except FileNotFoundError:
+        # Not built yet: static_url() falls back to the plain paths
+        return {}
+
+static_manifest = load_static_manifest()
+
+def static_url(path: str) -> str:
+    """URL of a static asset, fingerprinted when the build manifest knows it."""
+    return f"/static/{static_manifest.get(path, path)}"
+
+templates.env.globals['static_url'] = static_url
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        key, _, value = params.strip().partition("=")
+        try:
+            refused = key.strip() == "q" and float(value) == 0
+        except ValueError:
+            refused = False
+        if name.strip() and not refused:
+            encodings.add(name.strip().lower())
+    return encodings
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Serves fingerprinted assets from the build directory with their br/gzip sibling and immutable caching."""
+
+    async def get_response(self, path: str, scope) -> Response:
+        if not path.startswith(f"{STATIC_BUILD_DIR.name}/"):
+            return await super().get_response(path, scope)
+        
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        for encoding, suffix in STATIC_ENCODINGS:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await asyncio.to_thread(self.lookup_path, path + suffix)
+            if stat_result is not None:
+                response = self.file_response(full_path, stat_result, scope)
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                if media_type.startswith("text/"):
+                    media_type += "; charset=utf-8"
+                response.headers["Content-Type"] = media_type
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = await super().get_response(path, scope)
+        
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = CACHE_CONTROL["static"]
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
+
+# ============= PAGINATION =============
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 500))
+GALLERY_PAGE_SIZE = int(os.environ.get('GALLERY_PAGE_SIZE', 24))
+SERVICE_PAGE_SIZE = int(os.environ.get('SERVICE_PAGE_SIZE', 100))
+ADMIN_ALBUMS_PAGE_SIZE = int(os.environ.get('ADMIN_ALBUMS_PAGE_SIZE', 10))
+ADMIN_ALBUM_PHOTOS_PAGE_SIZE = int(os.environ.get('ADMIN_ALBUM_PHOTOS_PAGE_SIZE', 24))
+
+# Newest first; `id` breaks ties between documents created in the same instant
+PAGE_SORT = [("created_at", -1), ("id", -1)]
+
+def encode_cursor(doc: dict) -> str:
+    created_at = doc['created_at']
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, doc['id']], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}},
+    ]}
+
+async def fetch_page(collection, query: dict, projection: dict, limit: int, cursor: Optional[str] = None):
+    """Keyset pagination on (created_at, id). Returns the page and the cursor of the next one."""
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+    docs = await collection.find(query, projection).sort(PAGE_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+def photo_feed_pipeline(category: Optional[str], limit: int, cursor: Optional[str] = None) -> List[dict]:
+    """albums -> photos join returning newest photos with their album name and category.
+
+    Each album contributes at most `limit` photos through the (album_id, created_at, id)
+    index, so the outer sort only ever sees albums x limit documents.
+    """
+    photo_stages = [{"$match": READY_PHOTOS}]
+    if cursor:
+        photo_stages.append({"$match": decode_cursor(cursor)})
+    photo_stages += [
+        {"$sort": dict(PAGE_SORT)},
+        {"$limit": limit},
+        {"$project": PHOTO_SUMMARY_PROJECTION},
+    ]
+    # Either way the album scan stays on an index
+    first_stages = (
+        [{"$match": {"category": category, **LIVE_ALBUMS}}] if category
+        else [{"$match": LIVE_ALBUMS}, {"$sort": dict(PAGE_SORT)}]
+    )
+    return [
+        *first_stages,
+        {"$project": {"_id": 0, "id": 1, "name": 1, "category": 1}},
+        {"$lookup": {
+            "from": "photos",
+            "localField": "id",
+            "foreignField": "album_id",
+            "pipeline": photo_stages,
+            "as": "photos",
+        }},
+        {"$unwind": "$photos"},
+        {"$set": {"photos.album_name": "$name", "photos.album_category": "$category"}},
+        {"$replaceRoot": {"newRoot": "$photos"}},
+        {"$sort": dict(PAGE_SORT)},
+        {"$limit": limit},
+    ]
+
+async def fetch_photo_feed(category: Optional[str], limit: int, cursor: Optional[str] = None):
+    photos = await db.albums.aggregate(photo_feed_pipeline(category, limit + 1, cursor)).to_list(limit + 1)
+    next_cursor = encode_cursor(photos[limit - 1]) if len(photos) > limit else None
+    return photos[:limit], next_cursor
+
+def set_next_cursor(request: Request, response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+
+# ============= INDEXES =============
+# Finished and failed jobs are kept this long for inspection, then expire
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 7 * 24 * 3600))
+
+INDEXES = {
+    "albums": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("category", ASCENDING)], name="category"),
+        IndexModel([("name", ASCENDING)], name="name"),
+        IndexModel(PAGE_SORT, name="created_at_id"),
+    ],
+    "photos": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("album_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="album_id_created_at_id"),
+        IndexModel(PAGE_SORT, name="created_at_id"),
+        IndexModel([("source_media_id", ASCENDING)], name="source_media_id"),
+        # Only the few photos still waiting for derivatives are indexed
+        IndexModel([("status", ASCENDING)], name="status_processing",
+                   partialFilterExpression={"status": PHOTO_PROCESSING}),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)], name="status_locked_until"),
+        # At most one queued or running job per dedupe key
+        IndexModel([("active_key", ASCENDING)], unique=True, name="active_key_unique",
+                   partialFilterExpression={"active_key": {"$exists": True}}),
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=JOB_RETENTION, name="finished_at_ttl"),
+    ],
+}
+
+# Every query shape the server issues, checked by `manage.py check-indexes`.
+# Values are placeholders: only the shape matters to the planner. The media GC's
+# full read of the photos collection is deliberate and left out.
+SAMPLE_CURSOR = {"$or": [
+    {"created_at": {"$lt": "2000-01-01T00:00:00+00:00"}},
+    {"created_at": "2000-01-01T00:00:00+00:00", "id": {"$lt": "x"}},
+]}
+QUERY_SHAPES = [
+    ("albums", {"id": "x"}, None),
+    ("albums", {"id": "x", **LIVE_ALBUMS}, None),
+    ("albums", LIVE_ALBUMS, PAGE_SORT),
+    ("albums", {"$and": [LIVE_ALBUMS, SAMPLE_CURSOR]}, PAGE_SORT),
+    ("albums", LIVE_ALBUMS, [("name", ASCENDING)]),
+    ("photos", {"id": "x"}, None),
+    ("photos", {"album_id": "x"}, PAGE_SORT),
+    ("photos", {"$and": [{"album_id": "x"}, SAMPLE_CURSOR]}, PAGE_SORT),
+    ("photos", {"album_id": "x"}, None),
+    ("photos", {"album_id": {"$in": ["x", "y"]}}, PAGE_SORT),
+    ("photos", {"$and": [{"album_id": {"$in": ["x", "y"]}}, SAMPLE_CURSOR]}, PAGE_SORT),
+    ("photos", {"album_id": {"$in": ["x", "y"]}, **READY_PHOTOS}, PAGE_SORT),
+    ("photos", {"$and": [{"album_id": {"$in": ["x", "y"]}, **READY_PHOTOS}, SAMPLE_CURSOR]}, PAGE_SORT),
+    ("photos", {"album_id": {"$in": ["x", "y"]}}, None),
+    # The photo feed's $lookup sub-pipeline; explaining the aggregate does not show its inner plan
+    ("photos", {"album_id": "x", **READY_PHOTOS}, PAGE_SORT),
+    ("photos", {"$and": [{"album_id": "x", **READY_PHOTOS}, SAMPLE_CURSOR]}, PAGE_SORT),
+    ("photos", unclaimed_photos(datetime(2000, 1, 1, tzinfo=timezone.utc)), None),
+    ("photos", {"id": "x", **unclaimed_photos(datetime(2000, 1, 1, tzinfo=timezone.utc))}, None),
+    ("photos", {"id": "x", "status": PHOTO_PROCESSING}, None),
+    ("photos", {"source_media_id": "x", **PROCESSED_TWIN}, None),
+    ("users", {"email": "x"}, None),
+    ("site_state", {"_id": "content"}, None),
+    ("jobs", {"$or": [
+        {"status": "pending", "run_at": {"$lte": "2000-01-01T00:00:00+00:00"}},
+        {"status": "running", "locked_until": {"$lt": "2000-01-01T00:00:00+00:00"}},
+    ]}, [("run_at", ASCENDING)]),
+    ("jobs", {"id": "x", "status": "running"}, None),
+]
+AGGREGATE_SHAPES = [
+    ("albums", photo_feed_pipeline(None, 8)),
+    ("albums", photo_feed_pipeline("x", 25)),
+    ("albums", photo_feed_pipeline("x", 25, encode_cursor({"created_at": "2000-01-01T00:00:00+00:00", "id": "x"}))),
+]
+
+async def ensure_indexes():
+    """Create the declared indexes. create_indexes is a no-op for indexes that already exist."""
+    for collection_name, models in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(models)
+        except PyMongoError as e:
+            logger.error(f"Could not create indexes on {collection_name}: {e}")
+
+# ============= PAGE CACHE =============
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 256))
+
+class PageCache:
+    """In-process LRU cache of rendered public pages, keyed by (route, category, variant).
+
+    Each entry remembers the content version it was rendered under. Another process (a job
+    runner, an image worker) may bump the shared version without touching this cache, so an
+    entry from an older version is a miss rather than stale HTML under the new version's ETag.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple, version: int) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic() or entry[1] != version:
+            if entry is not None:
+                del self.entries[key]
+                if entry[1] != version:
+                    self.invalidations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: tuple, version: int, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, version, body)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, route: str, category: Optional[str] = None, any_category: bool = False) -> None:
+        stale = [key for key in self.entries if key[0] == route and (any_category or key[1] == category)]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+page_cache = PageCache(PAGE_CACHE_MAX_ENTRIES, PAGE_CACHE_TTL)
+
+def invalidate_pages(*categories: Optional[str], photos_changed: bool = True) -> None:
+    """Drop cached pages showing photos of albums in `categories`.
+
+    The unfiltered gallery lists every photo with its album category, so it is always dropped;
+    the home page only shows photos, so album-only changes leave it alone.
+    """
+    if photos_changed:
+        page_cache.invalidate("home")
+    page_cache.invalidate("gallery", None)
+    for category in set(categories):
+        if category:
+            page_cache.invalidate("gallery", category)
+            page_cache.invalidate("service", category)
+
+async def mark_content_changed(*categories: Optional[str], photos_changed: bool = True) -> None:
+    await bump_content_version()
+    invalidate_pages(*categories, photos_changed=photos_changed)
+
+async def album_category(album_id: str) -> Optional[str]:
+    album = await db.albums.find_one({"id": album_id}, {"_id": 0, "category": 1})
+    return album.get('category') if album else None
+
+def cached_page(key: tuple, version: int) -> Optional[HTMLResponse]:
+    body = page_cache.get(key, version)
+    return HTMLResponse(body) if body is not None else None
+
+def render_page(key: tuple, version: int, name: str, context: dict) -> Response:
+    if streaming_env is not None:
+        return StreamingResponse(stream_page(key, version, name, context), media_type="text/html")
+    response = templates.TemplateResponse(name, context)
+    page_cache.set(key, version, response.body)
+    return response
+
+async def stream_page(key: tuple, version: int, name: str, context: dict) -> AsyncIterator[bytes]:
+    """Yield the page as Jinja renders it, flushing right after </head>, and cache the full body."""
+    template = streaming_env.get_template(name)
+    started = time.perf_counter()
+    rendered = []
+    pending = []
+    pending_size = 0
+    async for piece in template.generate_async(context):
+        rendered.append(piece)
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= STREAM_FLUSH_BYTES or "</head>" in piece:
+            yield "".join(pending).encode("utf-8")
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending).encode("utf-8")
+    TEMPLATE_RENDER_LATENCY.labels(name).observe(time.perf_counter() - started)
+    page_cache.set(key, version, "".join(rendered).encode("utf-8"))
+
+# ============= BACKGROUND JOBS =============
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_LOCK_SECONDS = int(os.environ.get('JOB_LOCK_SECONDS', 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+# Retry delay for the first failure; doubles on each further attempt
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+MEDIA_GC_INTERVAL = int(os.environ.get('MEDIA_GC_INTERVAL', 6 * 3600))
+# Blobs written or reused more recently than this are never collected, covering in-flight uploads
+MEDIA_GC_GRACE = int(os.environ.get('MEDIA_GC_GRACE', 3600))
+
+JOB_HANDLERS = {}
+
+def job_handler(job_type: str):
+    """Register an idempotent coroutine as the handler for a job type; it may run more than once."""
+    def register(handler):
+        JOB_HANDLERS[job_type] = handler
+        return handler
+    return register
+
+async def enqueue_job(job_type: str, payload: Optional[dict] = None, dedupe_key: Optional[str] = None,
+                      job_id: Optional[str] = None) -> None:
+    """Queue a job. `dedupe_key` collapses it into an identical queued or running job; a fixed `job_id` runs it once ever."""
+    now = datetime.now(timezone.utc)
+    doc = {
+        "id": job_id or str(uuid.uuid4()),
+        "type": job_type,
+        "payload": payload or {},
+        "status": "pending",
+        "attempts": 0,
+        "run_at": now,
+        "created_at": now,
+    }
+    if dedupe_key:
+        doc["active_key"] = dedupe_key
+    try:
+        await db.jobs.insert_one(doc)
+    except DuplicateKeyError:
+        return
+    job_runner.wake()
+
+class JobRunner:
+    """Polls the jobs collection and runs due jobs one at a time on the event loop.
+
+    Claims are atomic, so every worker process can run its own JobRunner. A job whose
+    worker died is picked up again once its lock expires.
+    """
+
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self._task = None
+        self._next_gc = 0.0
+        # Every process already resumes image processing once at startup
+        self._next_resume = time.monotonic() + IMAGE_RESUME_INTERVAL
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._schedule_periodic()
+                job = await self._claim()
+                if job is not None:
+                    await self._execute(job)
+                    continue
+            except PyMongoError as e:
+                logger.warning(f"Job runner could not reach MongoDB: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _schedule_periodic(self) -> None:
+        # One id per interval, so several workers schedule a single run between them
+        if time.monotonic() >= self._next_gc:
+            self._next_gc = time.monotonic() + MEDIA_GC_INTERVAL
+            await enqueue_job("gc_media", job_id=f"gc_media:{int(time.time() // MEDIA_GC_INTERVAL)}")
+        if time.monotonic() >= self._next_resume:
+            self._next_resume = time.monotonic() + IMAGE_RESUME_INTERVAL
+            await enqueue_job("resume_image_processing",
+                              job_id=f"resume_image_processing:{int(time.time() // IMAGE_RESUME_INTERVAL)}")
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.jobs.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "running", "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "locked_until": now + timedelta(seconds=JOB_LOCK_SECONDS)},
+             "$inc": {"attempts": 1}},
+            {"_id": 0},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _execute(self, job: dict) -> None:
+        handler = JOB_HANDLERS.get(job["type"])
+        now = datetime.now(timezone.utc)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']!r}")
+            await handler(**job["payload"])
+        except Exception as e:
+            failed = job["attempts"] >= JOB_MAX_ATTEMPTS
+            logger.warning(f"Job {job['type']} {job['id']} attempt {job['attempts']} failed: {e!r}")
+            update = {"$set": {"last_error": repr(e)}}
+            if failed:
+                update["$set"].update(status="failed", finished_at=now)
+                update["$unset"] = {"active_key": "", "locked_until": ""}
+            else:
+                retry_at = now + timedelta(seconds=JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1))
+                update["$set"].update(status="pending", run_at=retry_at)
+                update["$unset"] = {"locked_until": ""}
+        else:
+            update = {"$set": {"status": "done", "finished_at": now}, "$unset": {"active_key": "", "locked_until": ""}}
+        await db.jobs.update_one({"id": job["id"], "status": "running"}, update)
+
+job_runner = JobRunner()
+
+async def soft_delete_album(album_id: str) -> Optional[dict]:
+    """Hide an album now and leave removing its photos to a background job."""
+    album = await db.albums.find_one_and_update(
+        {"id": album_id, **LIVE_ALBUMS},
+        {"$set": {"deleted_at": datetime.now(timezone.utc).isoformat()}},
+        {"_id": 0, "category": 1},
+    )
+    if album is not None:
+        await enqueue_job("cascade_album_delete", {"album_id": album_id}, dedupe_key=f"cascade_album_delete:{album_id}")
+        await mark_content_changed(album.get('category'))
+    return album
+
+# Photos of a soft-deleted album stay in the collection until its cascade runs; readers skip them
+async def album_is_live(album_id: str) -> bool:
+    return await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 1}) is not None
+
+async def live_album_ids() -> List[str]:
+    return [album['id'] async for album in db.albums.find(LIVE_ALBUMS, {"_id": 0, "id": 1}).sort("name", 1)]
+
+@job_handler("cascade_album_delete")
+async def cascade_album_delete(album_id: str) -> None:
+    album = await db.albums.find_one({"id": album_id}, {"_id": 0, "category": 1, "deleted_at": 1})
+    if album is None or album.get('deleted_at') is None:
+        return
+    await db.photos.delete_many({"album_id": album_id})
+    await db.albums.delete_one({"id": album_id})
+    await mark_content_changed(album.get('category'))
+    await enqueue_job("gc_media", dedupe_key="gc_media")
+
+@job_handler("resume_image_processing")
+async def resume_image_processing() -> None:
+    """Re-queue photos left `processing` by a worker process that stopped, or whose processing failed.
+
+    Takes only free queue slots, like uploads; when the queue fills up the job fails and its
+    retry queues the rest.
+    """
+    photos = db.photos.find(unclaimed_photos(datetime.now(timezone.utc)), {"_id": 0, "id": 1})
+    async for photo in photos:
+        if photo['id'] in image_workers.queued_ids:
+            continue
+        if image_workers.free_slots() <= 0:
+            raise RuntimeError("Image processing queue is full; resuming the remaining photos later")
+        image_workers.submit(photo['id'])
+
+@job_handler("gc_media")
+async def collect_media_garbage() -> None:
+    """Delete blobs that no photo or derivative references anymore."""
+    referenced = set()
+    async for photo in db.photos.find({}, {"_id": 0, "media_id": 1, "original_media_id": 1, "variants.media_id": 1}):
+        referenced.update((photo.get('media_id'), photo.get('original_media_id')))
+        referenced.update(variant['media_id'] for variant in photo.get('variants') or [])
+    
+    cutoff = time.time() - MEDIA_GC_GRACE
+    collected = 0
+    async for key, written_at in media_store.iter_blobs():
+        if key not in referenced and written_at < cutoff:
+            await media_store.delete(key)
+            collected += 1
+    purged = await media_store.purge_pending(cutoff)
+    logger.info(f"Media GC removed {collected} unreferenced blobs and {purged} stale partial uploads")
+
+# ============= HTTP CACHING =============
+# Cache-Control per route group; pages and API revalidate against the content version
+CACHE_CONTROL = {
+    "pages": os.environ.get('CACHE_CONTROL_PAGES', 'public, max-age=0, must-revalidate'),
+    "api": os.environ.get('CACHE_CONTROL_API', 'public, max-age=0, must-revalidate'),
+    "media": os.environ.get('CACHE_CONTROL_MEDIA', 'public, max-age=31536000, immutable'),
+    # /media URLs without the matching ?v= hash can start serving other bytes (e.g. after normalization)
+    "media_unversioned": os.environ.get('CACHE_CONTROL_MEDIA_UNVERSIONED', 'public, no-cache'),
+    "static": os.environ.get('CACHE_CONTROL_STATIC', 'public, max-age=31536000, immutable'),
+}
+# How long a worker trusts its copy of the content version before re-reading it
+CONTENT_VERSION_TTL = float(os.environ.get('CONTENT_VERSION_TTL', 2))
+
+content_state = {"version": None, "updated_at": None, "expires": 0.0}
+
+async def latest_modification() -> datetime:
+    latest = []
+    for collection in (db.albums, db.photos):
+        docs = await collection.find({}, {"_id": 0, "created_at": 1, "id": 1}).sort(PAGE_SORT).limit(1).to_list(1)
+        if docs:
+            created_at = docs[0]['created_at']
+            latest.append(datetime.fromisoformat(created_at) if isinstance(created_at, str) else created_at)
+    return max(latest, default=datetime(2000, 1, 1, tzinfo=timezone.utc))
+
+async def get_content_version() -> Tuple[int, datetime]:
+    """Site-wide content version and the time of the latest album/photo modification."""
+    if content_state['expires'] < time.monotonic():
+        state = await db.site_state.find_one({"_id": "content"})
+        if state:
+            content_state['version'] = state['version']
+            content_state['updated_at'] = datetime.fromisoformat(state['updated_at'])
+        else:
+            # Nothing written through this version of the server yet
+            content_state['version'] = 0
+            content_state['updated_at'] = await latest_modification()
+        content_state['expires'] = time.monotonic() + CONTENT_VERSION_TTL
+    return content_state['version'], content_state['updated_at']
+
+async def bump_content_version() -> None:
+    state = await db.site_state.find_one_and_update(
+        {"_id": "content"},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    content_state['version'] = state['version']
+    content_state['updated_at'] = datetime.fromisoformat(state['updated_at'])
+    content_state['expires'] = time.monotonic() + CONTENT_VERSION_TTL
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class ContentValidators:
+    """ETag/Last-Modified for a response whose body depends only on the URL and the content version."""
+
+    def __init__(self, request: Request, group: str, version: int, updated_at: datetime):
+        self.request = request
+        self.version = version
+        url_digest = hashlib.sha1(str(request.url.include_query_params()).encode('utf-8')).hexdigest()[:16]
+        self.etag = f'"{group}-{version}-{url_digest}"'
+        self.last_modified = updated_at.replace(microsecond=0)
+        self.headers = {
+            "ETag": self.etag,
+            "Last-Modified": format_datetime(self.last_modified, usegmt=True),
+            "Cache-Control": CACHE_CONTROL[group],
+        }
+
+    def is_fresh(self) -> bool:
+        if "if-none-match" in self.request.headers:
+            return etag_matches(self.request, self.etag)
+        if_modified_since = self.request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers=self.headers)
+
+    def apply(self, response: Response) -> Response:
+        response.headers.update(self.headers)
+        return response
+
+async def content_validators(request: Request, group: str) -> ContentValidators:
+    version, updated_at = await get_content_version()
+    return ContentValidators(request, group, version, updated_at)
+
 # ============= AUTH FUNCTIONS =============
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -106,6 +1667,10 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt is deliberately slow; keep it off the event loop
+async def hash_password(password):
+    return await asyncio.to_thread(get_password_hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE)
@@ -113,15 +1678,80 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def decode_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        return email
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 256))
+
+class PrincipalCache:
+    """In-process LRU cache of token -> user record, so authenticated requests skip the users lookup.
+
+    The app never modifies user records, so entries are not invalidated on writes: a change made
+    outside the app (e.g. directly in MongoDB) is picked up once AUTH_CACHE_TTL expires.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self.entries.get(token)
+        # Entries expire on the cache TTL or the token's own expiry, whichever is first
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[token]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, token: str, user: dict, token_expires: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self.entries[token] = (min(time.time() + self.ttl, token_expires), user)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def discard(self, token: str) -> None:
+        self.entries.pop(token, None)
+
+principal_cache = PrincipalCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL)
+
+async def principal_for_token(token: str) -> Optional[dict]:
+    """Resolve a JWT to its user record, consulting the principal cache first."""
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    user = await db.users.find_one({"email": payload["sub"]}, {"_id": 0})
+    if user is not None:
+        principal_cache.set(token, user, payload.get("exp", float("inf")))
+    return user
+
+async def ensure_admin_user(admin_email: str, admin_password: str) -> None:
+    existing_user = await db.users.find_one({"email": admin_email}, {"_id": 0})
+    if not existing_user:
+        user_obj = User(
+            email=admin_email,
+            password_hash=await hash_password(admin_password)
+        )
+        doc = user_obj.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        await db.users.insert_one(doc)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if not credentials:
@@ -130,14 +1760,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    email = verify_token(credentials.credentials)
-    if email is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = await db.users.find_one({"email": email}, {"_id": 0})
+    user = await principal_for_token(credentials.credentials)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -150,11 +1773,17 @@ async def get_current_user_from_cookie(request: Request):
     token = request.cookies.get("access_token")
     if not token:
         return None
-    email = verify_token(token)
-    if email is None:
-        return None
-    user = await db.users.find_one({"email": email}, {"_id": 0})
-    return user
+    return await principal_for_token(token)
+
+async def get_optional_user(request: Request) -> Optional[dict]:
+    """The caller's principal from a bearer token or the admin cookie; None for anonymous visitors."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return await principal_for_token(token)
+    return await get_current_user_from_cookie(request)
+
+# Photos still `processing` hold the raw upload (EXIF and GPS included); only signed-in admins see them
+UNREADY_CACHE_CONTROL = "private, no-store"
 
 # ============= API AUTH ROUTES =============
 @api_router.post("/auth/login", response_model=Token)
@@ -174,23 +1803,26 @@ async def api_login(user_data: UserLogin):
             detail="Incorrect email or password"
         )
     
-    existing_user = await db.users.find_one({"email": admin_email}, {"_id": 0})
-    if not existing_user:
-        user_obj = User(
-            email=admin_email,
-            password_hash=get_password_hash(admin_password)
-        )
-        doc = user_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.users.insert_one(doc)
+    await ensure_admin_user(admin_email, admin_password)
     
     access_token = create_access_token(data={"sub": admin_email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # ============= API ALBUM ROUTES =============
 @api_router.get("/albums", response_model=List[Album])
-async def get_albums():
-    albums = await db.albums.find({}, {"_id": 0}).to_list(1000)
+async def get_albums(
+    request: Request,
+    response: Response,
+    limit: int = Query(API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    validators = await content_validators(request, "api")
+    if validators.is_fresh():
+        return validators.not_modified()
+    
+    albums, next_cursor = await fetch_page(db.albums, LIVE_ALBUMS, {"_id": 0}, limit, cursor)
+    set_next_cursor(request, response, next_cursor)
+    response.headers.update(validators.headers)
     for album in albums:
         if isinstance(album['created_at'], str):
             album['created_at'] = datetime.fromisoformat(album['created_at'])
@@ -198,7 +1830,7 @@ async def get_albums():
 
 @api_router.get("/albums/{album_id}", response_model=Album)
 async def get_album(album_id: str):
-    album = await db.albums.find_one({"id": album_id}, {"_id": 0})
+    album = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
     if isinstance(album['created_at'], str):
@@ -211,16 +1843,18 @@ async def create_album(album_data: AlbumCreate, current_user: dict = Depends(get
     doc = album_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.albums.insert_one(doc)
+    await mark_content_changed(album_obj.category, photos_changed=False)
     return album_obj
 
 @api_router.put("/albums/{album_id}", response_model=Album)
 async def update_album(album_id: str, album_data: AlbumCreate, current_user: dict = Depends(get_current_user)):
-    result = await db.albums.find_one({"id": album_id}, {"_id": 0})
+    result = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
     if not result:
         raise HTTPException(status_code=404, detail="Album not found")
     
     update_data = album_data.model_dump()
-    await db.albums.update_one({"id": album_id}, {"$set": update_data})
+    await db.albums.update_one({"id": album_id, **LIVE_ALBUMS}, {"$set": update_data})
+    await mark_content_changed(result.get('category'), update_data['category'], photos_changed=False)
     
     updated_album = await db.albums.find_one({"id": album_id}, {"_id": 0})
     if isinstance(updated_album['created_at'], str):
@@ -229,27 +1863,68 @@ async def update_album(album_id: str, album_data: AlbumCreate, current_user: dic
 
 @api_router.delete("/albums/{album_id}")
 async def delete_album(album_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.albums.delete_one({"id": album_id})
-    if result.deleted_count == 0:
+    album = await soft_delete_album(album_id)
+    if album is None:
         raise HTTPException(status_code=404, detail="Album not found")
-    await db.photos.delete_many({"album_id": album_id})
     return {"message": "Album deleted successfully"}
 
 # ============= API PHOTO ROUTES =============
-@api_router.get("/photos", response_model=List[Photo])
-async def get_photos(album_id: Optional[str] = None):
-    query = {"album_id": album_id} if album_id else {}
-    photos = await db.photos.find(query, {"_id": 0}).to_list(1000)
+@api_router.get("/photos", response_model=List[PhotoSummary])
+async def get_photos(
+    request: Request,
+    response: Response,
+    album_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    limit: int = Query(API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    user = await get_optional_user(request)
+    if user is None:
+        validators = await content_validators(request, "api")
+        if validators.is_fresh():
+            return validators.not_modified()
+        response.headers.update(validators.headers)
+    else:
+        response.headers["Cache-Control"] = UNREADY_CACHE_CONTROL
+    
+    if album_id and not await album_is_live(album_id):
+        return []
+    query = {"album_id": album_id} if album_id else {"album_id": {"$in": await live_album_ids()}}
+    if user is None:
+        query.update(READY_PHOTOS)
+    selected = {f.strip() for f in fields.split(',') if f.strip()} if fields else None
+    include_image = include == "image" or (selected is not None and "image_data" in selected)
+    
+    projection = {"_id": 0} if include_image else PHOTO_SUMMARY_PROJECTION
+    photos, next_cursor = await fetch_page(db.photos, query, projection, limit, cursor)
+    set_next_cursor(request, response, next_cursor)
     for photo in photos:
         if isinstance(photo['created_at'], str):
             photo['created_at'] = datetime.fromisoformat(photo['created_at'])
-    return photos
+    
+    if not include_image and selected is None:
+        return photos
+    
+    if include_image:
+        for photo in photos:
+            if not photo.get('image_data'):
+                photo['image_data'] = await load_image_data(photo)
+    model = Photo if include_image else PhotoSummary
+    return JSONResponse(
+        [model(**photo).model_dump(mode="json", include=selected) for photo in photos],
+        headers=response.headers
+    )
 
 @api_router.get("/photos/{photo_id}", response_model=Photo)
-async def get_photo(photo_id: str):
+async def get_photo(request: Request, response: Response, photo_id: str):
     photo = await db.photos.find_one({"id": photo_id}, {"_id": 0})
-    if not photo:
+    if not photo or not await album_is_live(photo['album_id']):
         raise HTTPException(status_code=404, detail="Photo not found")
+    if photo.get('status') == PHOTO_PROCESSING:
+        if await get_optional_user(request) is None:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        response.headers["Cache-Control"] = UNREADY_CACHE_CONTROL
     if isinstance(photo['created_at'], str):
         photo['created_at'] = datetime.fromisoformat(photo['created_at'])
     return photo
@@ -263,27 +1938,25 @@ async def upload_photo(
     current_user: dict = Depends(get_current_user)
 ):
     # Verify album exists
-    album = await db.albums.find_one({"id": album_id}, {"_id": 0})
+    album = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
     
-    # Read and encode image
-    contents = await file.read()
-    image_base64 = base64.b64encode(contents).decode('utf-8')
-    mime_type = file.content_type
-    
-    # Create photo
-    photo_obj = Photo(
-        album_id=album_id,
-        title=title,
-        description=description,
-        image_data=f"data:{mime_type};base64,{image_base64}"
-    )
-    doc = photo_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.photos.insert_one(doc)
+    return await create_photo(album, title, description, file)
+
+@api_router.post("/photos/upload/batch", response_model=List[BatchUploadResult])
+async def upload_photos_batch(
+    album_id: str = Form(...),
+    title: str = Form(""),
+    description: str = Form(""),
+    files: List[UploadFile] = File(...),
+    current_user: dict = Depends(get_current_user)
+):
+    album = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
+    if not album:
+        raise HTTPException(status_code=404, detail="Album not found")
     
-    return photo_obj
+    return await create_photos(album, title, description, files)
 
 @api_router.put("/photos/{photo_id}", response_model=Photo)
 async def update_photo(photo_id: str, title: str = Form(...), description: str = Form(""), current_user: dict = Depends(get_current_user)):
@@ -292,6 +1965,7 @@ async def update_photo(photo_id: str, title: str = Form(...), description: str =
         raise HTTPException(status_code=404, detail="Photo not found")
     
     await db.photos.update_one({"id": photo_id}, {"$set": {"title": title, "description": description}})
+    await mark_content_changed(await album_category(result['album_id']))
     
     updated_photo = await db.photos.find_one({"id": photo_id}, {"_id": 0})
     if isinstance(updated_photo['created_at'], str):
@@ -300,9 +1974,10 @@ async def update_photo(photo_id: str, title: str = Form(...), description: str =
 
 @api_router.delete("/photos/{photo_id}")
 async def delete_photo(photo_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.photos.delete_one({"id": photo_id})
-    if result.deleted_count == 0:
+    photo = await db.photos.find_one_and_delete({"id": photo_id}, {"_id": 0, "album_id": 1})
+    if photo is None:
         raise HTTPException(status_code=404, detail="Photo not found")
+    await mark_content_changed(await album_category(photo['album_id']))
     return {"message": "Photo deleted successfully"}
 
 # ============= API PUBLIC ROUTES =============
@@ -314,54 +1989,163 @@ async def api_root():
 async def get_categories():
     return {"categories": CATEGORIES}
 
+@api_router.get("/gallery/manifest", response_model=GalleryManifest)
+async def get_gallery_manifest(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    limit: int = Query(GALLERY_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """What the lightbox needs to page through a gallery: same order and cursors as the gallery pages."""
+    validators = await content_validators(request, "api")
+    if validators.is_fresh():
+        return validators.not_modified()
+    
+    photos, next_cursor = await fetch_photo_feed(category, limit, cursor)
+    set_next_cursor(request, response, next_cursor)
+    response.headers.update(validators.headers)
+    return {
+        "photos": [
+            {
+                "id": photo['id'],
+                "title": photo['title'],
+                "description": photo.get('description') or "",
+                "album": photo['album_name'],
+                "category": photo['album_category'],
+                "src": lightbox_url(photo),
+            }
+            for photo in photos
+        ],
+        "next_cursor": next_cursor,
+    }
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(current_user: dict = Depends(get_current_user)):
+    return {"pages": page_cache.stats()}
+
+@api_router.get("/images/stats")
+async def get_image_worker_stats(current_user: dict = Depends(get_current_user)):
+    return image_workers.stats()
+
 # Include API router
 app.include_router(api_router)
 
+# ============= MEDIA ROUTES =============
+async def stream_media(request: Request, media_id: str, content_type: Optional[str],
+                       cache_control: Optional[str] = None):
+    # Blobs are content-addressed, so the key is a strong validator
+    versioned = request.query_params.get("v") == media_id[:12]
+    cache_control = cache_control or CACHE_CONTROL["media" if versioned else "media_unversioned"]
+    headers = {"ETag": f'"{media_id}"', "Cache-Control": cache_control}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        size, chunks = await media_store.open(media_id)
+    except (FileNotFoundError, NoFile):
+        raise HTTPException(status_code=404, detail="Media not found")
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type=content_type or "application/octet-stream", headers=headers)
+
+@app.get("/media/{photo_id}")
+async def get_media(request: Request, photo_id: str):
+    photo = await db.photos.find_one(
+        {"id": photo_id}, {"_id": 0, "id": 1, "album_id": 1, "media_id": 1, "content_type": 1, "status": 1}
+    )
+    if not photo or not await album_is_live(photo['album_id']):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    cache_control = None
+    if photo.get('status') == PHOTO_PROCESSING:
+        if await get_optional_user(request) is None:
+            raise HTTPException(status_code=404, detail="Photo not found")
+        cache_control = UNREADY_CACHE_CONTROL
+    
+    if not photo.get('media_id'):
+        # Not migrated yet: serve the legacy data URI as raw bytes
+        legacy = await db.photos.find_one({"id": photo_id}, {"_id": 0, "image_data": 1})
+        if not legacy or not legacy.get('image_data'):
+            raise HTTPException(status_code=404, detail="Media not found")
+        content_type, data = decode_data_uri(legacy['image_data'])
+        return Response(content=data, media_type=content_type)
+    
+    return await stream_media(request, photo['media_id'], photo.get('content_type'), cache_control)
+
+@app.get("/media/{photo_id}/{variant_name}")
+async def get_media_variant(request: Request, photo_id: str, variant_name: str):
+    width, _, fmt = variant_name.partition('.')
+    photo = await db.photos.find_one({"id": photo_id}, {"_id": 0, "id": 1, "album_id": 1, "variants": 1})
+    if not photo or not await album_is_live(photo['album_id']):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    
+    variant = next(
+        (v for v in photo.get('variants') or [] if str(v['width']) == width and v['format'] == fmt),
+        None
+    )
+    if not variant:
+        raise HTTPException(status_code=404, detail="Variant not found")
+    
+    return await stream_media(request, variant['media_id'], variant['content_type'])
+
 # ============= PAGE ROUTES (HTML) =============
 @app.get("/", response_class=HTMLResponse)
 async def home_page(request: Request):
-    albums = await db.albums.find({}, {"_id": 0}).to_list(1000)
-    photos = await db.photos.find({}, {"_id": 0}).to_list(1000)
-    return templates.TemplateResponse("home.html", {
+    validators = await content_validators(request, "pages")
+    if validators.is_fresh():
+        return validators.not_modified()
+    cache_key = ("home", None, None)
+    cached = cached_page(cache_key, validators.version)
+    if cached:
+        return validators.apply(cached)
+    
+    photos, _ = await fetch_photo_feed(None, 8)
+    return validators.apply(render_page(cache_key, validators.version, "home.html", {
         "request": request,
-        "albums": albums,
-        "photos": photos[:8],
+        "photos": photos,
         "categories": CATEGORIES
-    })
+    }))
 
 @app.get("/galeria", response_class=HTMLResponse)
 @app.get("/galeria/{category}", response_class=HTMLResponse)
-async def gallery_page(request: Request, category: str = None):
-    albums = await db.albums.find({}, {"_id": 0}).to_list(1000)
-    photos = await db.photos.find({}, {"_id": 0}).to_list(1000)
+async def gallery_page(request: Request, category: str = None, cursor: Optional[str] = None):
+    validators = await content_validators(request, "pages")
+    if validators.is_fresh():
+        return validators.not_modified()
+    cache_key = ("gallery", category, cursor)
+    cached = cached_page(cache_key, validators.version)
+    if cached:
+        return validators.apply(cached)
     
-    if category:
-        album_ids = [a['id'] for a in albums if a.get('category') == category]
-        filtered_photos = [p for p in photos if p.get('album_id') in album_ids]
-    else:
-        filtered_photos = photos
+    photos, next_cursor = await fetch_photo_feed(category, GALLERY_PAGE_SIZE, cursor)
     
-    return templates.TemplateResponse("gallery.html", {
+    return validators.apply(render_page(cache_key, validators.version, "gallery.html", {
         "request": request,
-        "albums": albums,
-        "photos": filtered_photos,
+        "photos": photos,
         "categories": CATEGORIES,
-        "current_category": category
-    })
+        "current_category": category,
+        "cursor": cursor,
+        "is_first_page": cursor is None,
+        "next_cursor": next_cursor
+    }))
 
 @app.get("/servicos/{service_name}", response_class=HTMLResponse)
 async def service_page(request: Request, service_name: str):
-    albums = await db.albums.find({"category": service_name}, {"_id": 0}).to_list(100)
-    album_ids = [a['id'] for a in albums]
-    photos = await db.photos.find({"album_id": {"$in": album_ids}}, {"_id": 0}).to_list(100)
+    validators = await content_validators(request, "pages")
+    if validators.is_fresh():
+        return validators.not_modified()
+    cache_key = ("service", service_name, None)
+    cached = cached_page(cache_key, validators.version)
+    if cached:
+        return validators.apply(cached)
     
-    return templates.TemplateResponse("service.html", {
+    photos, _ = await fetch_photo_feed(service_name, SERVICE_PAGE_SIZE)
+    
+    return validators.apply(render_page(cache_key, validators.version, "service.html", {
         "request": request,
         "service_name": service_name,
-        "albums": albums,
         "photos": photos,
         "categories": CATEGORIES
-    })
+    }))
 
 @app.get("/orcamento", response_class=HTMLResponse)
 async def orcamento_page(request: Request):
@@ -392,15 +2176,7 @@ async def login_submit(request: Request, response: Response):
             "error": "Email ou senha incorretos"
         })
     
-    existing_user = await db.users.find_one({"email": admin_email}, {"_id": 0})
-    if not existing_user:
-        user_obj = User(
-            email=admin_email,
-            password_hash=get_password_hash(admin_password)
-        )
-        doc = user_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        await db.users.insert_one(doc)
+    await ensure_admin_user(admin_email, admin_password)
     
     access_token = create_access_token(data={"sub": admin_email})
     
@@ -415,7 +2191,10 @@ async def login_submit(request: Request, response: Response):
     return response
 
 @app.get("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
+    token = request.cookies.get("access_token")
+    if token:
+        principal_cache.discard(token)
     response = RedirectResponse(url="/", status_code=302)
     response.delete_cookie("access_token")
     return response
@@ -426,17 +2205,55 @@ async def admin_page(request: Request):
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    albums = await db.albums.find({}, {"_id": 0}).to_list(1000)
-    photos = await db.photos.find({}, {"_id": 0}).to_list(1000)
+    cursor = request.query_params.get("cursor")
+    albums, next_cursor = await fetch_page(db.albums, LIVE_ALBUMS, {"_id": 0}, ADMIN_ALBUMS_PAGE_SIZE, cursor)
+    await asyncio.gather(*(attach_album_photos(album) for album in albums))
     
     return templates.TemplateResponse("admin.html", {
         "request": request,
         "user": user,
         "albums": albums,
-        "photos": photos,
-        "categories": CATEGORIES
+        "album_options": await admin_album_options(),
+        "categories": CATEGORIES,
+        "is_first_page": cursor is None,
+        "next_cursor": next_cursor
+    })
+
+@app.get("/admin/album/{album_id}", response_class=HTMLResponse)
+async def admin_album_page(request: Request, album_id: str):
+    """One album of the admin panel, with its photos paged past the first page."""
+    user = await get_current_user_from_cookie(request)
+    if not user:
+        return RedirectResponse(url="/login", status_code=302)
+    
+    album = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
+    if not album:
+        return RedirectResponse(url="/admin", status_code=302)
+    photos_cursor = request.query_params.get("cursor")
+    await attach_album_photos(album, photos_cursor)
+    
+    return templates.TemplateResponse("admin.html", {
+        "request": request,
+        "user": user,
+        "albums": [album],
+        "album_options": await admin_album_options(),
+        "categories": CATEGORIES,
+        "album_view": True,
+        "is_first_photos_page": photos_cursor is None,
+        "is_first_page": True,
+        "next_cursor": None
     })
 
+async def attach_album_photos(album: dict, cursor: Optional[str] = None) -> None:
+    """One page of an album's photos; the rest are reached through /admin/album/{id}."""
+    album['photos'], album['photos_cursor'] = await fetch_page(
+        db.photos, {"album_id": album['id']}, PHOTO_SUMMARY_PROJECTION, ADMIN_ALBUM_PHOTOS_PAGE_SIZE, cursor
+    )
+
+async def admin_album_options() -> List[dict]:
+    # The upload form can target any album, not just the ones on the page
+    return await db.albums.find(LIVE_ALBUMS, {"_id": 0, "id": 1, "name": 1}).sort("name", 1).to_list(None)
+
 # Admin form handlers
 @app.post("/admin/album/create")
 async def admin_create_album(request: Request):
@@ -453,6 +2270,7 @@ async def admin_create_album(request: Request):
     doc = album_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.albums.insert_one(doc)
+    await mark_content_changed(album_obj.category, photos_changed=False)
     
     return RedirectResponse(url="/admin", status_code=302)
 
@@ -468,7 +2286,11 @@ async def admin_edit_album(request: Request, album_id: str):
         "description": form_data.get("description"),
         "category": form_data.get("category")
     }
-    await db.albums.update_one({"id": album_id}, {"$set": update_data})
+    previous = await db.albums.find_one_and_update(
+        {"id": album_id, **LIVE_ALBUMS}, {"$set": update_data}, {"_id": 0, "category": 1}
+    )
+    if previous:
+        await mark_content_changed(previous.get('category'), update_data['category'], photos_changed=False)
     
     return RedirectResponse(url="/admin", status_code=302)
 
@@ -478,8 +2300,7 @@ async def admin_delete_album(request: Request, album_id: str):
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    await db.albums.delete_one({"id": album_id})
-    await db.photos.delete_many({"album_id": album_id})
+    await soft_delete_album(album_id)
     
     return RedirectResponse(url="/admin", status_code=302)
 
@@ -493,23 +2314,18 @@ async def admin_upload_photo(request: Request):
     album_id = form_data.get("album_id")
     title = form_data.get("title")
     description = form_data.get("description", "")
-    file = form_data.get("file")
+    files = [f for f in form_data.getlist("file") if getattr(f, "filename", None)]
     
-    if file and file.filename:
-        contents = await file.read()
-        if len(contents) <= 5 * 1024 * 1024:
-            image_base64 = base64.b64encode(contents).decode('utf-8')
-            mime_type = file.content_type or "image/jpeg"
-            
-            photo_obj = Photo(
-                album_id=album_id,
-                title=title,
-                description=description,
-                image_data=f"data:{mime_type};base64,{image_base64}"
-            )
-            doc = photo_obj.model_dump()
-            doc['created_at'] = doc['created_at'].isoformat()
-            await db.photos.insert_one(doc)
+    album = await db.albums.find_one({"id": album_id, **LIVE_ALBUMS}, {"_id": 0})
+    if album and files:
+        try:
+            results = await create_photos(album, title, description, files)
+        except HTTPException as e:
+            logger.info(f"Rejected admin upload of {len(files)} files: {e.detail}")
+        else:
+            for result in results:
+                if not result.ok:
+                    logger.info(f"Rejected admin upload {result.filename!r}: {result.error}")
     
     return RedirectResponse(url="/admin", status_code=302)
 
@@ -519,10 +2335,261 @@ async def admin_delete_photo(request: Request, photo_id: str):
     if not user:
         return RedirectResponse(url="/login", status_code=302)
     
-    await db.photos.delete_one({"id": photo_id})
+    photo = await db.photos.find_one_and_delete({"id": photo_id}, {"_id": 0, "album_id": 1})
+    if photo:
+        await mark_content_changed(await album_category(photo['album_id']))
     
     return RedirectResponse(url="/admin", status_code=302)
 
+# ============= DUPLICATE REPORT =============
+# Photos whose perceptual hashes differ in at most this many of 64 bits count as near-duplicates
+PHASH_DUPLICATE_DISTANCE = int(os.environ.get('PHASH_DUPLICATE_DISTANCE', 6))
+
+def hash_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def near_duplicate_groups(photos: List[dict], max_distance: int) -> List[List[dict]]:
+    """Cluster photos with different content whose perceptual hashes are within `max_distance` bits.
+
+    Two hashes that close agree exactly on at least one of `max_distance + 1` bit bands,
+    so only photos sharing a band are compared.
+    """
+    bands = max_distance + 1
+    bounds = [(64 * i // bands, 64 * (i + 1) // bands) for i in range(bands)]
+    buckets = {}
+    for index, photo in enumerate(photos):
+        value = int(photo['phash'], 16)
+        for band, (low, high) in enumerate(bounds):
+            buckets.setdefault((band, (value >> low) & ((1 << (high - low)) - 1)), []).append(index)
+    
+    parent = list(range(len(photos)))
+    
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for members in buckets.values():
+        for position, i in enumerate(members):
+            for j in members[position + 1:]:
+                if (photos[i]['media_id'] != photos[j]['media_id']
+                        and hash_distance(photos[i]['phash'], photos[j]['phash']) <= max_distance):
+                    parent[root(i)] = root(j)
+    
+    clusters = {}
+    for index, photo in enumerate(photos):
+        clusters.setdefault(root(index), []).append(photo)
+    # A cluster of copies of one blob is an exact duplicate, reported separately
+    return [group for group in clusters.values() if len({p['media_id'] for p in group}) > 1]
+
+async def duplicate_report() -> dict:
+    """Exact duplicates share one stored blob; near-duplicates are re-encodes, crops or resizes of the same shot."""
+    album_names = {
+        album['id']: album['name']
+        async for album in db.albums.find(LIVE_ALBUMS, {"_id": 0, "id": 1, "name": 1}).sort("name", 1)
+    }
+    photos = [
+        photo async for photo in db.photos.find(
+            {"album_id": {"$in": list(album_names)}},
+            {"_id": 0, "id": 1, "album_id": 1, "title": 1, "media_id": 1, "variants": 1, "phash": 1, "status": 1,
+             "width": 1, "height": 1, "placeholder": 1}
+        ) if photo.get('media_id')
+    ]
+    for photo in photos:
+        photo['album_name'] = album_names[photo['album_id']]
+    
+    by_media = {}
+    for photo in photos:
+        by_media.setdefault(photo['media_id'], []).append(photo)
+    hashed = [photo for photo in photos if photo.get('phash')]
+    near = await asyncio.to_thread(near_duplicate_groups, hashed, PHASH_DUPLICATE_DISTANCE)
+    return {
+        "exact_groups": [group for group in by_media.values() if len(group) > 1],
+        "near_groups": near,
+        "unhashed": len(photos) - len(hashed),
+        "max_distance": PHASH_DUPLICATE_DISTANCE,
+    }
+
+@app.get("/admin/duplicates", response_class=HTMLResponse)
+async def admin_duplicates_page(request: Request):
+    user = await get_current_user_from_cookie(request)
+    if not user:
+        return RedirectResponse(url="/login", status_code=302)
+    
+    return templates.TemplateResponse("duplicates.html", {
+        "request": request,
+        "user": user,
+        **await duplicate_report()
+    })
+
+# ============= RESPONSE COMPRESSION =============
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+# Media types whose payload is already compressed; SVG is the one image type worth compressing
+INCOMPRESSIBLE_TYPES = ("image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip", "application/octet-stream")
+
+class StreamCompressor:
+    """Incremental brotli/gzip encoder that flushes after every chunk so streamed bodies keep flowing."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def is_compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "")
+    if content_type.startswith("image/svg+xml"):
+        return True
+    return bool(content_type) and not content_type.startswith(INCOMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """Compresses HTML/JSON/text responses with brotli or gzip, buffered or streamed."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        
+        start_message = None
+        compressor = None
+
+        async def compressing_send(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                return await send(message)
+            
+            if compressor is None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                headers = Headers(raw=start_message["headers"])
+                content_length = headers.get("content-length")
+                too_small = (
+                    len(body) < COMPRESSION_MIN_SIZE if not more_body
+                    else content_length is not None and int(content_length) < COMPRESSION_MIN_SIZE
+                )
+                compressible = is_compressible(headers) and start_message["status"] not in (204, 304)
+                mutable = MutableHeaders(raw=start_message["headers"])
+                if compressible:
+                    # Caches must key every compressible response on Accept-Encoding, encoded or not
+                    mutable.add_vary_header("Accept-Encoding")
+                if encoding is None or too_small or not compressible:
+                    await send(start_message)
+                    start_message = None
+                    return await send(message)
+                
+                compressor = StreamCompressor(encoding)
+                mutable["Content-Encoding"] = encoding
+                # The encoded body is a different representation; keep ETags usable for revalidation
+                etag = mutable.get("etag")
+                if etag and not etag.startswith("W/"):
+                    mutable["ETag"] = f"W/{etag}"
+                if more_body:
+                    del mutable["Content-Length"]
+                    await send(start_message)
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    mutable["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    return await send({"type": "http.response.body", "body": body})
+            
+            body = compressor.compress(message.get("body", b""))
+            if message.get("more_body", False):
+                if body:
+                    await send({"type": "http.response.body", "body": body, "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": body + compressor.finish()})
+
+        await self.app(scope, receive, compressing_send)
+
+# ============= METRICS ENDPOINT =============
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+class CacheMetricsCollector:
+    """Exposes the in-process cache counters at scrape time."""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        page_stats = page_cache.stats()
+        for name, value, help_text in (
+            ("page_cache_hits", page_stats["hits"], "Page cache hits"),
+            ("page_cache_misses", page_stats["misses"], "Page cache misses"),
+            ("page_cache_evictions", page_stats["evictions"], "Page cache LRU evictions"),
+            ("page_cache_invalidations", page_stats["invalidations"], "Page cache entries dropped by content changes"),
+            ("principal_cache_hits", principal_cache.hits, "Authenticated principal cache hits"),
+            ("principal_cache_misses", principal_cache.misses, "Authenticated principal cache misses"),
+        ):
+            yield CounterMetricFamily(f"oriani_{name}", help_text, value=value)
+        yield GaugeMetricFamily("oriani_page_cache_entries", "Pages currently cached", value=page_stats["entries"])
+        yield GaugeMetricFamily("oriani_page_cache_hit_ratio", "Page cache hits / lookups", value=page_stats["hit_ratio"])
+
+REGISTRY.register(CacheMetricsCollector())
+
+class ImageWorkerMetricsCollector:
+    """Exposes the image worker queue at scrape time."""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        stats = image_workers.stats()
+        yield GaugeMetricFamily("oriani_image_queue_depth", "Photos waiting for derivatives", value=stats["queued"])
+        yield GaugeMetricFamily("oriani_image_queue_capacity", "Photos that may wait before uploads get a 503", value=stats["capacity"])
+        yield GaugeMetricFamily("oriani_image_jobs_in_progress", "Photos being processed right now", value=stats["in_progress"])
+        yield CounterMetricFamily("oriani_image_jobs_processed", "Photos whose derivatives were built", value=stats["processed"])
+        yield CounterMetricFamily("oriani_image_jobs_failed", "Photos left processing after an error", value=stats["failed"])
+
+REGISTRY.register(ImageWorkerMetricsCollector())
+
+async def metrics_authorized(request: Request) -> bool:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    if METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN):
+        return True
+    return await principal_for_token(token) is not None
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if not await metrics_authorized(request):
+        return Response(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+app.add_middleware(UploadLimitMiddleware, limits=UPLOAD_BODY_LIMITS)
+
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -531,6 +2598,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(QueryTrackingMiddleware)
+
+# Outermost, so latency and sizes cover everything the client actually receives
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -538,6 +2610,72 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ============= TEMPLATE WARM-UP =============
+def warm_up_contexts() -> dict:
+    """Sample data covering every branch the page templates take for real content."""
+    request = Request({
+        "type": "http", "method": "GET", "path": "/", "root_path": "", "scheme": "http",
+        "server": ("localhost", 80), "headers": [], "query_string": b"", "app": app,
+    })
+    album = Album(name="Álbum", description="Exemplo", category=CATEGORIES[0]).model_dump()
+    variants = [
+        PhotoVariant(width=width, height=width * 3 // 4, format=fmt, content_type=f"image/{fmt}", media_id="0" * 64, size=0)
+        for width in DERIVATIVE_WIDTHS for fmt in DERIVATIVE_FORMATS
+    ]
+    photo = Photo(album_id=album['id'], title="Foto", description="Exemplo", media_id="0" * 64,
+                  content_type="image/jpeg", size=0, variants=variants, width=4, height=3,
+                  placeholder="data:image/webp;base64,").model_dump()
+    photo.update(album_name=album['name'], album_category=album['category'])
+    processing = Photo(album_id=album['id'], title="Foto", media_id="0" * 64, content_type="image/jpeg",
+                       size=0, status=PHOTO_PROCESSING).model_dump()
+    common = {"request": request, "categories": CATEGORIES}
+    return {
+        "home.html": {**common, "photos": [photo]},
+        "gallery.html": {**common, "photos": [photo], "current_category": None, "cursor": "warm-up", "is_first_page": False, "next_cursor": "warm-up"},
+        "service.html": {**common, "photos": [photo], "service_name": CATEGORIES[0]},
+        "orcamento.html": common,
+        "login.html": {"request": request, "error": "Exemplo"},
+        "admin.html": {**common, "user": {"email": "admin@example.com"}, "album_options": [album],
+                       "albums": [{**album, "photos": [photo, processing], "photos_cursor": "warm-up"}],
+                       "album_view": True, "is_first_photos_page": False, "is_first_page": False, "next_cursor": "warm-up"},
+        "duplicates.html": {**common, "user": {"email": "admin@example.com"}, "exact_groups": [[photo, photo]],
+                            "near_groups": [[photo, photo]], "unhashed": 1, "max_distance": PHASH_DUPLICATE_DISTANCE},
+    }
+
+async def warm_up_templates() -> None:
+    """Compile every template into the bytecode cache and render each page once before serving."""
+    started = time.perf_counter()
+    environments = [templates.env] + ([streaming_env] if streaming_env is not None else [])
+    for env in environments:
+        for name in env.list_templates():
+            env.get_template(name)
+    
+    for name, context in warm_up_contexts().items():
+        templates.get_template(name).render(context)
+        if streaming_env is not None:
+            async for _ in streaming_env.get_template(name).generate_async(context):
+                pass
+    logger.info(f"Templates compiled and warmed up in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def warm_up():
+    await warm_up_templates()
+
+@app.on_event("startup")
+async def start_job_runner():
+    job_runner.start()
+
+@app.on_event("startup")
+async def start_image_workers():
+    image_workers.start()
+    await enqueue_job("resume_image_processing", dedupe_key="resume_image_processing")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await job_runner.stop()
+    await image_workers.stop()
     client.close()
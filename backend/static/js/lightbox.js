@@ -0,0 +1,107 @@
+// Photo lightbox shared by the home, gallery and service pages.
+//
+// Cards carry their own lightbox image in data attributes, so a click opens the
+// lightbox immediately. The first open fetches /api/gallery/manifest (starting at
+// the page's cursor, filtered by its category) for navigation; later manifest pages
+// load as the visitor reaches the end, and neighbouring images are prefetched.
+(function () {
+    const lightbox = document.getElementById('lightbox');
+    if (!lightbox) return;
+    const img = document.getElementById('lightbox-img');
+    const titleEl = document.getElementById('lightbox-title');
+    const descEl = document.getElementById('lightbox-desc');
+
+    let photos = null;
+    let nextCursor = null;
+    let loading = null;
+    let currentIndex = -1;
+
+    function manifestUrl(cursor) {
+        const params = new URLSearchParams();
+        if (lightbox.dataset.category) params.set('category', lightbox.dataset.category);
+        if (cursor) params.set('cursor', cursor);
+        return '/api/gallery/manifest?' + params;
+    }
+
+    function loadPage(cursor) {
+        if (!loading) {
+            loading = fetch(manifestUrl(cursor))
+                .then((response) => {
+                    if (!response.ok) throw new Error('manifest ' + response.status);
+                    return response.json();
+                })
+                .then((page) => {
+                    photos = (photos || []).concat(page.photos);
+                    nextCursor = page.next_cursor;
+                })
+                .finally(() => { loading = null; });
+        }
+        return loading;
+    }
+
+    function show(photo) {
+        img.src = photo.src;
+        img.alt = photo.title;
+        titleEl.textContent = photo.title;
+        if (descEl) descEl.textContent = photo.description || '';
+    }
+
+    function prefetch() {
+        for (const offset of [1, -1]) {
+            const neighbour = photos[(currentIndex + offset + photos.length) % photos.length];
+            if (neighbour) new Image().src = neighbour.src;
+        }
+        // Fetch the next manifest page before the visitor runs out of loaded photos
+        if (nextCursor && currentIndex >= photos.length - 2) loadPage(nextCursor).catch(() => {});
+    }
+
+    async function openLightbox(card) {
+        show({ src: card.dataset.lightboxSrc, title: card.dataset.title, description: card.dataset.description });
+        lightbox.classList.add('active');
+        document.body.style.overflow = 'hidden';
+        try {
+            if (photos === null) await loadPage(lightbox.dataset.cursor);
+            currentIndex = photos.findIndex((photo) => photo.id === card.dataset.photoId);
+            while (currentIndex < 0 && nextCursor) {
+                await loadPage(nextCursor);
+                currentIndex = photos.findIndex((photo) => photo.id === card.dataset.photoId);
+            }
+            if (currentIndex >= 0) prefetch();
+        } catch (error) {
+            // Without the manifest the lightbox still shows the clicked photo
+            currentIndex = -1;
+        }
+    }
+
+    function closeLightbox() {
+        lightbox.classList.remove('active');
+        document.body.style.overflow = '';
+    }
+
+    async function step(delta) {
+        if (!photos || currentIndex < 0) return;
+        if (currentIndex + delta >= photos.length && nextCursor) {
+            try {
+                await loadPage(nextCursor);
+            } catch (error) {
+                // Wrap around within what is already loaded
+            }
+        }
+        currentIndex = (currentIndex + delta + photos.length) % photos.length;
+        show(photos[currentIndex]);
+        prefetch();
+    }
+
+    lightbox.addEventListener('click', closeLightbox);
+    document.addEventListener('keydown', (e) => {
+        if (!lightbox.classList.contains('active')) return;
+        if (e.key === 'Escape') closeLightbox();
+        if (e.key === 'ArrowRight') step(1);
+        if (e.key === 'ArrowLeft') step(-1);
+    });
+
+    window.openLightbox = openLightbox;
+    window.closeLightbox = closeLightbox;
+    window.nextPhoto = () => step(1);
+    window.prevPhoto = () => step(-1);
+})();
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Load/latency benchmark for the Oriani backend.
+
+Seeds albums and photos through the API, drives every public route, the /api
+listings, media and uploads at fixed concurrency levels, and reports
+throughput, p50/p95/p99 latency and response bytes per route. Results can be
+saved as a baseline and later runs compared against it.
+
+Usage:
+    python backend_benchmark.py --base-url http://localhost:8001
+    python backend_benchmark.py --in-process --save-baseline benchmark_baseline.json
+    python backend_benchmark.py --in-process --baseline benchmark_baseline.json
+
+--in-process starts the app inside this process on an in-memory MongoDB
+stand-in (requires mongomock-motor), with media in a temporary directory
+instead of GridFS. Client threads then share the GIL with the server, so
+compare in-process runs only with other in-process runs.
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+BENCH_ALBUM_PREFIX = "[bench]"
+# Browsers always advertise compression; measure what they would receive
+CLIENT_HEADERS = {"Accept-Encoding": "gzip, br"}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return 0.0
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+def phone_photo(width, height, seed):
+    """JPEG with sensor-like noise, so it compresses like a real photo rather than a flat color"""
+    noise = Image.effect_noise((width, height), 48 + seed % 16).convert("RGB")
+    tint = Image.new("RGB", (width, height), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    image = Image.blend(noise, tint, 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def patch_mongomock_lookup():
+    """mongomock lacks `$lookup` with both localField and a sub-pipeline, which the photo feed uses.
+
+    Expand that stage by hand so the in-memory stand-in can serve the gallery pages.
+    """
+    import mongomock.collection
+
+    aggregate = mongomock.collection.Collection.aggregate
+
+    def aggregate_with_lookup(self, pipeline, *args, **kwargs):
+        for position, stage in enumerate(pipeline):
+            lookup = stage.get("$lookup")
+            if not lookup or "pipeline" not in lookup:
+                continue
+            documents = list(aggregate(self, pipeline[:position]))
+            foreign = self.database[lookup["from"]]
+            for document in documents:
+                match = {"$match": {lookup["foreignField"]: document.get(lookup["localField"])}}
+                document[lookup["as"]] = list(aggregate(foreign, [match] + lookup["pipeline"]))
+            staging = self.database[f"_lookup_{threading.get_ident()}"]
+            staging.drop()
+            if documents:
+                staging.insert_many(documents)
+            return aggregate(staging, [{"$project": {"_id": 0}}] + pipeline[position + 1:], *args, **kwargs)
+        return aggregate(self, pipeline, *args, **kwargs)
+
+    mongomock.collection.Collection.aggregate = aggregate_with_lookup
+
+
+def start_in_process_server(email, password):
+    """Serve the app on a free local port with an in-memory database; returns the base URL"""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("--in-process needs mongomock-motor: pip install mongomock-motor")
+    import uvicorn
+
+    patch_mongomock_lookup()
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["ADMIN_EMAIL"] = email
+    os.environ["ADMIN_PASSWORD"] = password
+    sys.path.insert(0, str(Path(__file__).parent / "backend"))
+    import server
+
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ.get("DB_NAME", "oriani_benchmark")]
+    # A GridFS store would still point at the real Motor client
+    server.media_store = server.FileSystemMediaStore(tempfile.mkdtemp(prefix="oriani-bench-media-"))
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=uvicorn_server.run, daemon=True).start()
+    while not uvicorn_server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+class BackendBenchmark:
+    def __init__(self, base_url, email, password, args):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.args = args
+        self.session = requests.Session()
+        self.token = None
+        self.album_ids = []
+        self.categories = []
+        self.upload_image = None
+        self._local = threading.local()
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def login(self):
+        response = self.session.post(f"{self.base_url}/api/auth/login", json={"email": self.email, "password": self.password})
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+    def seed(self):
+        """Create the benchmark albums and photos through the upload API"""
+        print(f"Seeding {self.args.albums} albums x {self.args.photos_per_album} photos "
+              f"({self.args.photo_width}x{self.args.photo_height})...")
+        self.categories = self.session.get(f"{self.base_url}/api/categories").json()["categories"]
+        for index in range(self.args.albums):
+            category = self.categories[index % len(self.categories)]
+            response = self.session.post(
+                f"{self.base_url}/api/albums",
+                json={"name": f"{BENCH_ALBUM_PREFIX} {index}", "description": "Álbum de benchmark", "category": category},
+                headers=self.auth_headers(),
+            )
+            response.raise_for_status()
+            album_id = response.json()["id"]
+            self.album_ids.append(album_id)
+
+            remaining = self.args.photos_per_album
+            while remaining > 0:
+                count = min(remaining, 10)
+                files = [
+                    ("files", (f"foto{n}.jpg", phone_photo(self.args.photo_width, self.args.photo_height, index * 1000 + remaining - n), "image/jpeg"))
+                    for n in range(count)
+                ]
+                response = self.session.post(
+                    f"{self.base_url}/api/photos/upload/batch",
+                    data={"album_id": album_id, "title": f"Obra {index}"},
+                    files=files,
+                    headers=self.auth_headers(),
+                )
+                response.raise_for_status()
+                remaining -= count
+        self.upload_image = phone_photo(self.args.photo_width, self.args.photo_height, 424242)
+        self.wait_for_processing()
+
+    def wait_for_processing(self, timeout=600):
+        """Uploads return before the image workers finish; pages only list photos once they are ready"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            processing = 0
+            params = {"fields": "status", "limit": 500}
+            while True:
+                # Anonymous listings only include ready photos
+                response = self.session.get(f"{self.base_url}/api/photos", params=params, headers=self.auth_headers())
+                response.raise_for_status()
+                processing += sum(1 for photo in response.json() if photo.get("status") == "processing")
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+                params["cursor"] = cursor
+            if not processing:
+                return
+            time.sleep(0.5)
+        raise RuntimeError(f"{processing} photos still processing after {timeout}s")
+
+    def cleanup(self):
+        for album_id in self.album_ids:
+            self.session.delete(f"{self.base_url}/api/albums/{album_id}", headers=self.auth_headers())
+
+    def routes(self):
+        """(name, method, path, request kwargs) for every route under test"""
+        photos = self.session.get(f"{self.base_url}/api/photos", params={"limit": 1}).json()
+        category = self.categories[0]
+        routes = [
+            ("home", "GET", "/", {}),
+            ("gallery", "GET", "/galeria", {}),
+            ("gallery_category", "GET", f"/galeria/{category}", {}),
+            ("service", "GET", f"/servicos/{category}", {}),
+            ("orcamento", "GET", "/orcamento", {}),
+            ("api_albums", "GET", "/api/albums", {}),
+            ("api_photos", "GET", "/api/photos", {}),
+            ("api_categories", "GET", "/api/categories", {}),
+            ("api_gallery_manifest", "GET", "/api/gallery/manifest", {}),
+        ]
+        if photos:
+            photo = photos[0]
+            routes.append(("media_original", "GET", photo["image_url"], {}))
+            if photo.get("variants"):
+                variant = photo["variants"][0]
+                routes.append(("media_variant", "GET", f"/media/{photo['id']}/{variant['width']}.{variant['format']}", {}))
+        if not self.args.skip_uploads:
+            routes.append(("upload", "POST", "/api/photos/upload", {"upload": True}))
+        return routes
+
+    def thread_session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request_once(self, method, path, options):
+        """Send one request; returns (latency seconds, wire bytes, ok)"""
+        kwargs = {"headers": dict(CLIENT_HEADERS), "stream": True}
+        if options.get("upload"):
+            kwargs["headers"].update(self.auth_headers())
+            kwargs["data"] = {"album_id": self.album_ids[0], "title": "Benchmark upload"}
+            kwargs["files"] = {"file": ("upload.jpg", self.upload_image, "image/jpeg")}
+        started = time.perf_counter()
+        try:
+            response = self.thread_session().request(method, f"{self.base_url}{path}", **kwargs)
+            # Count bytes as sent on the wire, before any decompression
+            body = response.raw.read(decode_content=False)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            return time.perf_counter() - started, 0, False
+        return time.perf_counter() - started, len(body), ok
+
+    def run_route(self, method, path, options, concurrency):
+        for _ in range(self.args.warmup):
+            self.request_once(method, path, options)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            count = self.args.upload_requests if options.get("upload") else self.args.requests
+            samples = list(executor.map(lambda _: self.request_once(method, path, options), range(count)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _, _ in samples)
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for _, _, ok in samples if not ok),
+            "throughput": len(samples) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "bytes": sum(size for _, size, _ in samples) / len(samples),
+        }
+
+    def run(self):
+        self.login()
+        self.seed()
+        results = {}
+        try:
+            routes = self.routes()
+            # Uploads grow the dataset, so they run after every read route has been measured
+            reads = [route for route in routes if not route[3].get("upload")]
+            writes = [route for route in routes if route[3].get("upload")]
+            for group in (reads, writes):
+                for concurrency in self.args.concurrency if group else ():
+                    print(f"\n=== Concurrency {concurrency} ===")
+                    print(f"{'route':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>10} {'errors':>7}")
+                    for name, method, path, options in group:
+                        stats = self.run_route(method, path, options, concurrency)
+                        results[f"{name}@{concurrency}"] = stats
+                        print(f"{name:<22} {stats['throughput']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                              f"{stats['p99_ms']:>9.1f} {stats['bytes']:>10.0f} {stats['errors']:>7}")
+        finally:
+            if not self.args.keep_data:
+                self.cleanup()
+        return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` against `baseline` as printable lines"""
+    regressions = []
+    for key, stats in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if stats["errors"] > before["errors"]:
+            regressions.append(f"{key}: errors {before['errors']} -> {stats['errors']}")
+        if stats["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {before['p95_ms']:.1f}ms -> {stats['p95_ms']:.1f}ms")
+        if stats["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {before['throughput']:.1f} -> {stats['throughput']:.1f} req/s")
+        if stats["bytes"] > before["bytes"] * (1 + tolerance):
+            regressions.append(f"{key}: bytes {before['bytes']:.0f} -> {stats['bytes']:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Oriani backend load/latency benchmark")
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--in-process", action="store_true", help="Benchmark an in-process app on an in-memory database")
+    parser.add_argument("--email", default=os.environ.get("ADMIN_EMAIL", "benchmark@oriani.com.br"))
+    parser.add_argument("--password", default=os.environ.get("ADMIN_PASSWORD", "benchmark"))
+    parser.add_argument("--albums", type=int, default=6)
+    parser.add_argument("--photos-per-album", type=int, default=20)
+    parser.add_argument("--photo-width", type=int, default=1600)
+    parser.add_argument("--photo-height", type=int, default=1200)
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route and concurrency level")
+    parser.add_argument("--upload-requests", type=int, default=20, help="Uploads per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--skip-uploads", action="store_true")
+    parser.add_argument("--keep-data", action="store_true", help="Leave the seeded albums in place")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Compare against a stored baseline and fail on regressions")
+    parser.add_argument("--save-baseline", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    base_url = start_in_process_server(args.email, args.password) if args.in_process else args.base_url
+    print(f"🚀 Benchmarking {base_url}")
+    results = BackendBenchmark(base_url, args.email, args.password, args).run()
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            Path(path).write_text(json.dumps(results, indent=2, sort_keys=True))
+            print(f"\nResults written to {path}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions against {args.baseline}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,77 +2,293 @@
 """
 Simple redirect server that forwards all requests to the FastAPI backend.
 This replaces the React frontend since we're now using Python full-stack.
+
+Requests are handled by a bounded pool of worker threads, and backend
+connections are kept alive and reused across requests. Request and
+response bodies are streamed through in PROXY_BUFFER_SIZE pieces, so
+memory per request stays bounded regardless of the payload size.
 """
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 import http.client
 import os
+import queue
+import select
+import threading
+import time
+
+BACKEND_HOST = os.environ.get('BACKEND_HOST', 'localhost')
+BACKEND_PORT = int(os.environ.get('BACKEND_PORT', 8001))
+PROXY_WORKERS = int(os.environ.get('PROXY_WORKERS', 32))
+PROXY_POOL_SIZE = int(os.environ.get('PROXY_POOL_SIZE', 16))
+PROXY_CONNECT_TIMEOUT = float(os.environ.get('PROXY_CONNECT_TIMEOUT', 5))
+PROXY_READ_TIMEOUT = float(os.environ.get('PROXY_READ_TIMEOUT', 60))
+PROXY_BUFFER_SIZE = int(os.environ.get('PROXY_BUFFER_SIZE', 64 * 1024))
+# Must stay below the backend's keep-alive timeout (uvicorn closes idle connections after 5s)
+PROXY_IDLE_TIMEOUT = float(os.environ.get('PROXY_IDLE_TIMEOUT', 4))
+
+# Errors that mean a pooled keep-alive connection was closed by the backend
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class ConnectionPool:
+    """Bounded pool of idle keep-alive connections to the backend"""
+
+    def __init__(self, host, port, size, connect_timeout, read_timeout, idle_timeout):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        # (connection, time it went idle)
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def acquire(self):
+        """Return (connection, reused), skipping idle connections the backend may have closed.
+
+        A request body cannot be replayed once streamed, so a stale connection has to be caught
+        here rather than by retrying after the send fails.
+        """
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self.connect(), False
+            if time.monotonic() - idle_since < self.idle_timeout and not self.closed_by_peer(conn):
+                return conn, True
+            conn.close()
+
+    @staticmethod
+    def closed_by_peer(conn):
+        # An idle keep-alive socket only turns readable once the backend has closed it
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+        return bool(readable)
+
+    def release(self, conn, response):
+        if response.will_close:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+pool = ConnectionPool(
+    BACKEND_HOST, BACKEND_PORT, PROXY_POOL_SIZE, PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT, PROXY_IDLE_TIMEOUT
+)
+
+
+class RequestBody:
+    """Iterates the client request body in bounded pieces, decoding chunked uploads"""
+
+    def __init__(self, rfile, content_length=None, chunked=False):
+        self.rfile = rfile
+        self.content_length = content_length
+        self.chunked = chunked
+        self.consumed = 0
+
+    def __iter__(self):
+        pieces = self._read_chunked() if self.chunked else self._read_fixed()
+        for piece in pieces:
+            self.consumed += len(piece)
+            yield piece
+
+    def _read_fixed(self):
+        remaining = self.content_length
+        while remaining > 0:
+            piece = self.rfile.read(min(PROXY_BUFFER_SIZE, remaining))
+            if not piece:
+                raise ConnectionError('Client closed the connection mid-body')
+            remaining -= len(piece)
+            yield piece
+
+    def _read_chunked(self):
+        while True:
+            size_line = self.rfile.readline(65537)
+            chunk_size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if chunk_size == 0:
+                # Skip trailers up to the terminating blank line
+                while self.rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            remaining = chunk_size
+            while remaining > 0:
+                piece = self.rfile.read(min(PROXY_BUFFER_SIZE, remaining))
+                if not piece:
+                    raise ConnectionError('Client closed the connection mid-chunk')
+                remaining -= len(piece)
+                yield piece
+            self.rfile.readline(65537)
 
-BACKEND_HOST = 'localhost'
-BACKEND_PORT = 8001
 
 class ProxyHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so chunked backend responses can be relayed as they arrive;
+    # every response closes the client connection so idle clients never pin a worker
+    protocol_version = 'HTTP/1.1'
+
+    def send_to_backend(self, method, body, headers):
+        """Send the request on a pooled connection, retrying once if it had gone stale"""
+        conn, reused = pool.acquire()
+        try:
+            conn.request(method, self.path, body=body, headers=headers, encode_chunked=body is not None and body.chunked)
+            return conn, conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            # A streamed body cannot be replayed once part of it was sent
+            if not reused or (body is not None and body.consumed):
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        conn = pool.connect()
+        try:
+            conn.request(method, self.path, body=body, headers=headers, encode_chunked=body is not None and body.chunked)
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+
+    def request_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return RequestBody(self.rfile, chunked=True)
+        content_length = int(self.headers.get('Content-Length', 0))
+        return RequestBody(self.rfile, content_length=content_length) if content_length > 0 else None
+
+    def relay_response(self, conn, response):
+        self.send_response(response.status)
+
+        # Forward response headers
+        for header, value in response.getheaders():
+            if header.lower() not in ['transfer-encoding', 'connection']:
+                self.send_header(header, value)
+        chunked = response.chunked and self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        # Stream response body
+        while True:
+            piece = response.read1(PROXY_BUFFER_SIZE)
+            if not piece:
+                break
+            if chunked:
+                self.wfile.write(f'{len(piece):X}\r\n'.encode() + piece + b'\r\n')
+            else:
+                self.wfile.write(piece)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        # read1() leaves a fully consumed response open; read() marks it finished
+        response.read()
+        pool.release(conn, response)
+
     def do_request(self, method):
         """Forward request to backend"""
+        self.close_connection = True
+        headers_sent = False
         try:
-            # Read request body if present
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length) if content_length > 0 else None
-            
-            # Connect to backend
-            conn = http.client.HTTPConnection(BACKEND_HOST, BACKEND_PORT)
-            
-            # Forward headers
+            body = self.request_body()
+
+            # Forward headers; http.client re-frames chunked uploads itself
             headers = {}
             for header, value in self.headers.items():
-                if header.lower() not in ['host', 'connection']:
+                if header.lower() not in ['host', 'connection', 'transfer-encoding']:
                     headers[header] = value
-            
+
             # Make request to backend
-            conn.request(method, self.path, body=body, headers=headers)
-            response = conn.getresponse()
-            
-            # Send response back
-            self.send_response(response.status)
-            
-            # Forward response headers
-            for header, value in response.getheaders():
-                if header.lower() not in ['transfer-encoding', 'connection']:
-                    self.send_header(header, value)
-            self.end_headers()
-            
-            # Send response body
-            self.wfile.write(response.read())
-            conn.close()
-            
+            conn, response = self.send_to_backend(method, body, headers)
+            headers_sent = True
+            try:
+                self.relay_response(conn, response)
+            except Exception:
+                conn.close()
+                raise
+
         except Exception as e:
+            if headers_sent:
+                # Too late for a 502; dropping the connection signals the truncation
+                self.log_error('Proxy error mid-response: %s', e)
+                return
+            message = f'Proxy Error: {str(e)}'.encode()
             self.send_response(502)
             self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(message)))
+            self.send_header('Connection', 'close')
             self.end_headers()
-            self.wfile.write(f'Proxy Error: {str(e)}'.encode())
-    
+            self.wfile.write(message)
+
     def do_GET(self):
         self.do_request('GET')
-    
+
     def do_POST(self):
         self.do_request('POST')
-    
+
     def do_PUT(self):
         self.do_request('PUT')
-    
+
     def do_DELETE(self):
         self.do_request('DELETE')
-    
+
     def do_PATCH(self):
         self.do_request('PATCH')
-    
+
     def do_OPTIONS(self):
         self.do_request('OPTIONS')
-    
+
     def log_message(self, format, *args):
         print(f"[Proxy] {self.address_string()} - {format % args}")
 
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that handles each connection on a bounded pool of worker threads"""
+
+    def __init__(self, server_address, handler_class, workers):
+        super().__init__(server_address, handler_class)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proxy')
+        # Stop accepting while every worker is busy; the listen backlog absorbs bursts
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+        pool.close()
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 3000))
-    server = HTTPServer(('0.0.0.0', port), ProxyHandler)
-    print(f'Proxy server running on port {port}, forwarding to backend on port {BACKEND_PORT}')
-    server.serve_forever()
+    server = ThreadPoolHTTPServer(('0.0.0.0', port), ProxyHandler, PROXY_WORKERS)
+    print(f'Proxy server running on port {port} with {PROXY_WORKERS} workers, '
+          f'forwarding to backend on port {BACKEND_PORT}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -9,7 +9,7 @@ import Login from '@/pages/Login';
 import Orcamento from '@/pages/Orcamento';
 import ServicePage from '@/pages/ServicePage';
 
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+export const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 export const API = `${BACKEND_URL}/api`;
 
 export const AuthContext = React.createContext();
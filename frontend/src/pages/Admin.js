@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useContext } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
-import { API, AuthContext } from '@/App';
+import { API, BACKEND_URL, AuthContext } from '@/App';
 import { Plus, Trash2, Edit2, LogOut, Image as ImageIcon, FolderPlus } from 'lucide-react';
 
 const Admin = () => {
@@ -249,7 +249,7 @@ const Admin = () => {
                       {albumPhotos.map((photo) => (
                         <div key={photo.id} className="relative group">
                           <img
-                            src={photo.image_data}
+                            src={`${BACKEND_URL}${photo.image_url}`}
                             alt={photo.title}
                             className="w-full aspect-square object-cover rounded-lg"
                           />
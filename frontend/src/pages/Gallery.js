@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import axios from 'axios';
-import { API } from '@/App';
+import { API, BACKEND_URL } from '@/App';
 import { X, ChevronLeft, ChevronRight } from 'lucide-react';
 
 const Gallery = () => {
@@ -125,7 +125,7 @@ const Gallery = () => {
                 >
                   <div className="aspect-square overflow-hidden">
                     <img
-                      src={photo.image_data}
+                      src={`${BACKEND_URL}${photo.image_url}`}
                       alt={photo.title}
                       className="w-full h-full object-cover group-hover:scale-110 transition duration-300"
                     />
@@ -175,7 +175,7 @@ const Gallery = () => {
           </button>
           <div className="max-w-4xl max-h-[90vh] p-4" onClick={(e) => e.stopPropagation()}>
             <img
-              src={selectedPhoto.image_data}
+              src={`${BACKEND_URL}${selectedPhoto.image_url}`}
               alt={selectedPhoto.title}
               className="max-w-full max-h-[80vh] object-contain mx-auto"
             />
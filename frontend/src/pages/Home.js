@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import axios from 'axios';
-import { API } from '@/App';
+import { API, BACKEND_URL } from '@/App';
 import { Link } from 'react-router-dom';
 import { Phone, Mail, MapPin, Wrench, Droplet, Package, Zap, PaintBucket } from 'lucide-react';
 
@@ -113,7 +113,7 @@ const Home = () => {
                 {photos.slice(0, 8).map((photo) => (
                   <div key={photo.id} className="aspect-square overflow-hidden rounded-lg shadow-md group">
                     <img 
-                      src={photo.image_data} 
+                      src={`${BACKEND_URL}${photo.image_url}`} 
                       alt={photo.title}
                       className="w-full h-full object-cover group-hover:scale-110 transition duration-300"
                     />
@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { useParams, Link } from 'react-router-dom';
 import axios from 'axios';
-import { API } from '@/App';
+import { API, BACKEND_URL } from '@/App';
 import { ArrowRight, Check } from 'lucide-react';
 
 const serviceContent = {
@@ -238,7 +238,7 @@ const ServicePage = () => {
               {photos.map((photo) => (
                 <div key={photo.id} className="aspect-square overflow-hidden rounded-lg shadow-md">
                   <img 
-                    src={photo.image_data} 
+                    src={`${BACKEND_URL}${photo.image_url}`} 
                     alt={photo.title}
                     className="w-full h-full object-cover hover:scale-110 transition duration-300"
                   />
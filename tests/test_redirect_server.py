@@ -0,0 +1,176 @@
+import io
+import socket
+import time
+
+import pytest
+
+import redirect_server
+from redirect_server import ConnectionPool, ProxyHandler, RequestBody
+
+
+def chunked(*chunks):
+    return b''.join(f'{len(c):x}\r\n'.encode() + c + b'\r\n' for c in chunks) + b'0\r\n\r\n'
+
+
+def test_read_fixed_stops_at_content_length():
+    body = RequestBody(io.BytesIO(b'hello world, and the next request'), content_length=11)
+    assert b''.join(body) == b'hello world'
+    assert body.consumed == 11
+
+
+def test_read_fixed_rejects_truncated_body():
+    with pytest.raises(ConnectionError):
+        b''.join(RequestBody(io.BytesIO(b'short'), content_length=10))
+
+
+def test_read_chunked_decodes_chunks():
+    body = RequestBody(io.BytesIO(chunked(b'hello ', b'chunked ', b'world')), chunked=True)
+    assert b''.join(body) == b'hello chunked world'
+    assert body.consumed == 19
+
+
+def test_read_chunked_ignores_extensions_and_skips_trailers():
+    rfile = io.BytesIO(b'5;name=value\r\nhello\r\n0\r\nX-Checksum: abc\r\n\r\nNEXT')
+    assert b''.join(RequestBody(rfile, chunked=True)) == b'hello'
+    # The terminating blank line is consumed, nothing past it
+    assert rfile.read() == b'NEXT'
+
+
+def test_read_chunked_splits_large_chunks(monkeypatch):
+    monkeypatch.setattr(redirect_server, 'PROXY_BUFFER_SIZE', 4)
+    pieces = list(RequestBody(io.BytesIO(chunked(b'0123456789')), chunked=True))
+    assert pieces == [b'0123', b'4567', b'89']
+
+
+def test_read_chunked_rejects_truncated_chunk():
+    with pytest.raises(ConnectionError):
+        b''.join(RequestBody(io.BytesIO(b'a\r\nshort'), chunked=True))
+
+
+class FakeConnection:
+    def __init__(self, error=None, consume=0):
+        self.error = error
+        self.consume = consume
+        self.closed = False
+        self.requests = 0
+
+    def request(self, method, path, body=None, headers=None, encode_chunked=False):
+        self.requests += 1
+        if body is not None and self.consume:
+            pieces = iter(body)
+            for _ in range(self.consume):
+                next(pieces)
+        if self.error:
+            raise self.error
+
+    def getresponse(self):
+        return 'response'
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    def __init__(self, pooled, reused, fresh):
+        self.pooled = pooled
+        self.reused = reused
+        self.fresh = fresh
+
+    def acquire(self):
+        return self.pooled, self.reused
+
+    def connect(self):
+        return self.fresh
+
+
+def send(monkeypatch, pooled, reused, body=None):
+    fresh = FakeConnection()
+    monkeypatch.setattr(redirect_server, 'pool', FakePool(pooled, reused, fresh))
+    handler = ProxyHandler.__new__(ProxyHandler)
+    handler.path = '/api/photos'
+    return handler.send_to_backend('POST', body, {}), fresh
+
+
+def test_stale_reused_connection_is_retried_on_a_fresh_one(monkeypatch):
+    pooled = FakeConnection(error=BrokenPipeError())
+    (conn, response), fresh = send(monkeypatch, pooled, reused=True)
+    assert pooled.closed
+    assert conn is fresh and response == 'response'
+
+
+def test_stale_connection_retried_when_no_body_was_streamed(monkeypatch):
+    pooled = FakeConnection(error=ConnectionResetError())
+    body = RequestBody(io.BytesIO(b'payload'), content_length=7)
+    (conn, _), fresh = send(monkeypatch, pooled, reused=True, body=body)
+    assert conn is fresh and fresh.requests == 1
+
+
+def test_stale_connection_not_retried_after_body_was_streamed(monkeypatch):
+    pooled = FakeConnection(error=BrokenPipeError(), consume=1)
+    body = RequestBody(io.BytesIO(b'payload'), content_length=7)
+    with pytest.raises(BrokenPipeError):
+        send(monkeypatch, pooled, reused=True, body=body)
+    assert pooled.closed
+
+
+def test_fresh_connection_failure_is_not_retried(monkeypatch):
+    pooled = FakeConnection(error=BrokenPipeError())
+    with pytest.raises(BrokenPipeError):
+        send(monkeypatch, pooled, reused=False)
+
+
+def test_other_errors_are_not_retried(monkeypatch):
+    pooled = FakeConnection(error=TimeoutError())
+    with pytest.raises(TimeoutError):
+        send(monkeypatch, pooled, reused=True)
+    assert pooled.closed
+
+
+class SocketConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+
+@pytest.fixture
+def socket_pair():
+    ours, theirs = socket.socketpair()
+    yield SocketConnection(ours), theirs
+    ours.close()
+    theirs.close()
+
+
+class KeepAlive:
+    will_close = False
+
+
+def pool_with(conn, idle_timeout=60):
+    pool = ConnectionPool('localhost', 1, 4, 1, 1, idle_timeout)
+    pool.release(conn, KeepAlive())
+    pool.connect = lambda: 'new connection'
+    return pool
+
+
+def test_pool_reuses_live_idle_connection(socket_pair):
+    conn, _ = socket_pair
+    assert pool_with(conn).acquire() == (conn, True)
+
+
+def test_pool_discards_connections_idle_past_the_limit(socket_pair):
+    conn, _ = socket_pair
+    pool = pool_with(conn, idle_timeout=0.01)
+    time.sleep(0.02)
+    assert pool.acquire() == ('new connection', False)
+    assert conn.closed
+
+
+def test_pool_discards_connections_closed_by_the_backend(socket_pair):
+    conn, backend = socket_pair
+    pool = pool_with(conn)
+    backend.close()
+    assert pool.acquire() == ('new connection', False)
+    assert conn.closed
@@ -0,0 +1,273 @@
+import asyncio
+import base64
+import gzip
+import io
+import json
+import random
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from server import (
+    CompressionMiddleware, decode_cursor, encode_cursor, hash_distance, near_duplicate_groups, sniff_image_type,
+)
+
+
+# ============= CURSORS =============
+def test_cursor_round_trips_to_keyset_query():
+    cursor = encode_cursor({"created_at": "2024-05-01T12:00:00+00:00", "id": "abc"})
+    assert decode_cursor(cursor) == {"$or": [
+        {"created_at": {"$lt": "2024-05-01T12:00:00+00:00"}},
+        {"created_at": "2024-05-01T12:00:00+00:00", "id": {"$lt": "abc"}},
+    ]}
+
+
+def test_cursor_accepts_datetimes_and_is_url_safe():
+    created_at = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    cursor = encode_cursor({"created_at": created_at, "id": "?/+"})
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor)["$or"][1] == {"created_at": created_at.isoformat(), "id": {"$lt": "?/+"}}
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor",
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    base64.urlsafe_b64encode(b'["only one"]').decode(),
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+# ============= UPLOADS =============
+def encoded(fmt):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fmt, content_type", [
+    ("JPEG", "image/jpeg"),
+    ("PNG", "image/png"),
+    ("GIF", "image/gif"),
+    ("WEBP", "image/webp"),
+])
+def test_sniff_image_type_recognizes_encoded_images(fmt, content_type):
+    assert sniff_image_type(encoded(fmt)[:32]) == content_type
+
+
+def test_sniff_image_type_recognizes_avif_brands():
+    assert sniff_image_type(b"\x00\x00\x00\x1cftypavif\x00\x00\x00\x00") == "image/avif"
+    assert sniff_image_type(b"\x00\x00\x00\x1cftypavis\x00\x00\x00\x00") == "image/avif"
+
+
+@pytest.mark.parametrize("head", [
+    b"",
+    b"<svg xmlns='http://www.w3.org/2000/svg'/>",
+    b"\x00\x00\x00\x1cftypheic",
+    b"RIFF\x00\x00\x00\x00WAVEfmt ",
+    b"%PDF-1.7",
+])
+def test_sniff_image_type_rejects_other_content(head):
+    assert sniff_image_type(head) is None
+
+
+# ============= DUPLICATE REPORT =============
+def photo(photo_id, phash, media_id=None):
+    return {"id": photo_id, "phash": f"{phash:016x}", "media_id": media_id or f"m-{photo_id}"}
+
+
+def grouped_ids(groups):
+    return sorted(sorted(p["id"] for p in group) for group in groups)
+
+
+def test_near_duplicates_within_distance_are_grouped():
+    base = 0x0123456789ABCDEF
+    photos = [
+        photo("a", base),
+        photo("b", base ^ 0b111),  # 3 bits away
+        photo("c", base ^ (0b1111111 << 40)),  # 7 bits away
+        photo("d", ~base & (2 ** 64 - 1)),
+    ]
+    assert grouped_ids(near_duplicate_groups(photos, 6)) == [["a", "b"]]
+
+
+def test_near_duplicate_groups_are_transitive():
+    base = 0xF0F0F0F0F0F0F0F0
+    photos = [photo("a", base), photo("b", base ^ 0b1111), photo("c", base ^ 0b11111111)]
+    # a-c differ in 8 bits, but each is 4 bits from b
+    assert grouped_ids(near_duplicate_groups(photos, 4)) == [["a", "b", "c"]]
+
+
+def test_copies_of_one_blob_are_not_near_duplicates():
+    photos = [photo("a", 42, media_id="same"), photo("b", 42, media_id="same"), photo("c", ~42 & (2 ** 64 - 1))]
+    assert near_duplicate_groups(photos, 6) == []
+
+
+def test_copies_join_a_near_duplicate_group_of_another_blob():
+    photos = [photo("a", 42, media_id="same"), photo("b", 42, media_id="same"), photo("c", 43)]
+    assert grouped_ids(near_duplicate_groups(photos, 6)) == [["a", "b", "c"]]
+
+
+def brute_force_groups(photos, max_distance):
+    parent = list(range(len(photos)))
+
+    def root(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(photos)):
+        for j in range(i + 1, len(photos)):
+            if (photos[i]["media_id"] != photos[j]["media_id"]
+                    and hash_distance(photos[i]["phash"], photos[j]["phash"]) <= max_distance):
+                parent[root(i)] = root(j)
+    clusters = {}
+    for index, p in enumerate(photos):
+        clusters.setdefault(root(index), []).append(p)
+    return [group for group in clusters.values() if len({p["media_id"] for p in group}) > 1]
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 6, 10])
+def test_banding_matches_pairwise_comparison(max_distance):
+    rng = random.Random(max_distance)
+    photos = []
+    for i in range(200):
+        if photos and rng.random() < 0.5:
+            # Perturb an earlier hash so there are plenty of near pairs right around the limit
+            source = int(rng.choice(photos)["phash"], 16)
+            for bit in rng.sample(range(64), rng.randint(0, max_distance + 2)):
+                source ^= 1 << bit
+            photos.append(photo(str(i), source))
+        else:
+            photos.append(photo(str(i), rng.getrandbits(64)))
+    expected = grouped_ids(brute_force_groups(photos, max_distance))
+    assert expected
+    assert grouped_ids(near_duplicate_groups(photos, max_distance)) == expected
+
+
+# ============= COMPRESSION =============
+def run_compressed(messages, accept_encoding="gzip", method="GET"):
+    """Drive CompressionMiddleware around an app that sends `messages`; return what reaches the client."""
+
+    async def app(scope, receive, send):
+        for message in messages:
+            await send(message)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    scope = {"type": "http", "method": method, "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+    start, *bodies = sent
+    headers = {name.decode().lower(): value.decode() for name, value in start["headers"]}
+    return start["status"], headers, bodies
+
+
+def response_start(content_type, content_length=None, etag=None, status=200):
+    headers = [(b"content-type", content_type.encode())]
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    if etag:
+        headers.append((b"etag", etag.encode()))
+    return {"type": "http.response.start", "status": status, "headers": headers}
+
+
+PAYLOAD = json.dumps([{"id": i, "title": "Obra"} for i in range(200)]).encode()
+
+
+ENCODINGS = [
+    ("gzip", gzip.decompress),
+    pytest.param("br", brotli and brotli.decompress, marks=pytest.mark.skipif(brotli is None, reason="brotli not installed")),
+]
+
+
+@pytest.mark.parametrize("encoding, decompress", ENCODINGS)
+def test_buffered_response_is_compressed_with_its_length(encoding, decompress):
+    status, headers, bodies = run_compressed([
+        response_start("application/json", len(PAYLOAD), etag='"v1"'),
+        {"type": "http.response.body", "body": PAYLOAD},
+    ], accept_encoding=f"{encoding}, deflate")
+    assert status == 200
+    assert headers["content-encoding"] == encoding
+    assert headers["vary"] == "Accept-Encoding"
+    assert headers["etag"] == 'W/"v1"'
+    assert len(bodies) == 1 and not bodies[0].get("more_body")
+    assert int(headers["content-length"]) == len(bodies[0]["body"]) < len(PAYLOAD)
+    assert decompress(bodies[0]["body"]) == PAYLOAD
+
+
+def test_small_response_is_sent_as_is_but_varies():
+    body = b'{"ok": true}'
+    _, headers, bodies = run_compressed([
+        response_start("application/json", len(body)),
+        {"type": "http.response.body", "body": body},
+    ])
+    assert "content-encoding" not in headers
+    assert headers["vary"] == "Accept-Encoding"
+    assert bodies == [{"type": "http.response.body", "body": body}]
+
+
+def test_images_and_uncompressed_clients_are_passed_through():
+    image = response_start("image/webp", len(PAYLOAD))
+    _, headers, bodies = run_compressed([image, {"type": "http.response.body", "body": PAYLOAD}])
+    assert "content-encoding" not in headers and "vary" not in headers
+    assert bodies[0]["body"] == PAYLOAD
+
+    _, headers, bodies = run_compressed([
+        response_start("text/html", len(PAYLOAD)),
+        {"type": "http.response.body", "body": PAYLOAD},
+    ], accept_encoding="identity")
+    assert "content-encoding" not in headers
+    assert headers["vary"] == "Accept-Encoding"
+    assert bodies[0]["body"] == PAYLOAD
+
+
+def test_head_requests_are_not_compressed():
+    _, headers, _ = run_compressed([
+        response_start("text/html", len(PAYLOAD)),
+        {"type": "http.response.body", "body": b""},
+    ], method="HEAD")
+    assert "content-encoding" not in headers
+
+
+@pytest.mark.parametrize("encoding, decompress", ENCODINGS)
+def test_streamed_response_is_compressed_chunk_by_chunk(encoding, decompress):
+    chunks = [PAYLOAD[i:i + 1000] for i in range(0, len(PAYLOAD), 1000)]
+    messages = [response_start("text/html; charset=utf-8")]
+    messages += [{"type": "http.response.body", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.response.body", "body": b""})
+    _, headers, bodies = run_compressed(messages, accept_encoding=encoding)
+    assert headers["content-encoding"] == encoding
+    assert "content-length" not in headers
+    # Every chunk is flushed as it arrives rather than held until the end
+    assert len(bodies) == len(chunks) + 1
+    assert all(message.get("more_body") for message in bodies[:-1])
+    assert not bodies[-1].get("more_body")
+    assert decompress(b"".join(message["body"] for message in bodies)) == PAYLOAD
+
+
+def test_streamed_response_with_small_declared_length_is_not_compressed():
+    messages = [
+        response_start("text/plain", 10),
+        {"type": "http.response.body", "body": b"01234", "more_body": True},
+        {"type": "http.response.body", "body": b"56789"},
+    ]
+    _, headers, bodies = run_compressed(messages)
+    assert "content-encoding" not in headers
+    assert headers["content-length"] == "10"
+    assert b"".join(message["body"] for message in bodies) == b"0123456789"